@@ -1,60 +1,602 @@
+import hashlib
+import json
+import math
 import os
 import sys
 import time
+from argparse import Namespace
+from collections import deque
+from heapq import heappush, heappop
 from random import randint
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from socket import *
-from struct import *
-from typing import NamedTuple, Union, Tuple, Generator, BinaryIO, List, Dict, Optional
+from typing import NamedTuple, Union, Tuple, Generator, List, Dict, Optional
 
 from arg_parser import parse_args
+from batch_io import BatchIO
+from bundle import BundleSink, BundleSource
+from compression import CompressedSource, decode
+from congestion_control import CONGESTION_CONTROLLERS
+from fec import MAX_BLOCK, ParityDecoder, ParityEncoder, block_start
+from file_sink import FileSink
+from file_source import FileSource
+from handshake_options import OPTIONS_VERSION, decode_options, encode_options
+from pacer import Pacer
+from packet_codec import HEADER_SIZE, SYN_FLAG, ACK_FLAG, FIN_FLAG, RST_FLAG, PARITY_FLAG, HeaderPool, encode, \
+    decode_header
+from path_mtu import MAX_DATAGRAM, probe_sizes, set_dont_fragment
+from reorder_window import ReorderWindow
+from rto_estimator import RtoEstimator
+from sack_scoreboard import SackScoreboard
 
 """ CONSTANTS """
 
-# I integer (unsigned long) = 4bytes and H (unsigned short integer 2 bytes)
-HEADER_FORMAT = '!IIHH'
-HEADER_SIZE = 12
-DATA_SIZE = 1460
+DATA_SIZE = 1460  # Payload of a packet when the path is not probed, and the unit of the server's buffer size
 PACKAGE_SIZE = HEADER_SIZE + DATA_SIZE
-SEP = "<SEPARATOR>"
+MAX_DATA_SIZE = MAX_DATAGRAM - HEADER_SIZE  # Largest payload that fits in a UDP datagram
+ACK_DELAY = 0.01  # Longest time in seconds an ack is delayed when delayed acks are enabled
+CONNECTION_TIMEOUT = 120  # Seconds without packages from a client before the server drops its connection
+LINGER_TIME = 2.0  # Seconds a finished connection is kept to ack a retransmitted fin
+CHECKPOINT_INTERVAL = 1.0  # Seconds between checkpoints of how much of a file has been received
+CHECKPOINT_WORKERS = 4  # Threads that flush received files to disk and save their checkpoints
+DIGEST = "sha256"  # Hash of the data, computed by both sides while it is sent and compared on fin
+DUPLICATE_ACKS = 3  # Duplicate acks of the packet before a lost packet that make the client resend it right away
+PACING_GAIN = 1.25  # Pacing rate as a multiple of the window over the RTT, so pacing does not hold the window back
+SLOW_START_PACING_GAIN = 2.0  # Pacing gain while the congestion window doubles every RTT
 METHOD_NAMES = {"saw": "stop and wait", "gbn": "go back N", "sr": "selective repeat"}
 
 # Types
 Flags = NamedTuple('Flags', syn=bool, ack=bool, fin=bool)
 Header = NamedTuple('Header', seq=int, ack=int, flags=int, win=int)
+Packet = Union[bytes, Tuple[memoryview, memoryview]]  # Whole packet, or pooled header and a view of the mapped data
+Source = Union[FileSource, BundleSource, CompressedSource]  # What the client reads the data of its packets from
+# Range of the file sent by one of the parallel streams of a transfer
+Stream = NamedTuple('Stream', transfer_id=str, index=int, count=int, offset=int, length=int)
 
 """ SERVER """
 
 
 class Server:
-    last_valid_seq: int
+    def __init__(self, options: Namespace):
+        """
+        Initialize server using arguments.
+        The server does not depend on how packages are received and sent, start_server runs it on a blocking socket.
+        :param options: server options, see arg_parser.parse_args
+        """
+        self.options = options
+
+        # Connection, opened by start_server
+        self.server_socket = None
+        self.batch_io = None
+
+        # Packages waiting to be sent with their destination, sent together after every batch
+        self.queued_packages: List[bytes] = []
+        self.queued_addresses: List[Tuple[str, int]] = []
+
+        # Transfers in progress, by the address of the client
+        self.connections: Dict[Tuple[str, int], Connection] = {}
 
-    def __init__(self):
+        # Files being received, by the ip of the client and the id of the transfer, shared by the streams of a file
+        self.transfers: Dict[Tuple[str, str], Transfer] = {}
+
+        # Checkpoints are saved on worker threads, flushing a file to disk does not hold up the packages of the others
+        self.checkpoint_pool = ThreadPoolExecutor(max_workers=CHECKPOINT_WORKERS)
+
+        # Heap of (deadline, address) of the connection timers, outdated entries are skipped lazily
+        self.timers: List[Tuple[float, Tuple[str, int]]] = []
+
+        # Set when the first transfer has ended, and the error that ended the transfer if it failed
+        self.served = False
+        self.error: Optional[str] = None
+
+    def start_server(self) -> None:
         """
-        Initialize server using arguments
+        Receive packages from clients and hand them to the connection of their source address.
+        Every connection runs its own handshake and transfer, so with options.keep_running many files are received at
+        the same time and the server keeps running. Otherwise the server exits when the first transfer has ended.
+        The socket only waits until the earliest connection timer is due.
         """
-        # Connection
         self.server_socket = socket(AF_INET, SOCK_DGRAM)
-        self.client_address = None
+        grow_receive_buffer(self.server_socket, self.options.buffer_size * PACKAGE_SIZE)
+
+        # Clients choose their payload size, so every buffer fits the largest datagram
+        self.batch_io = BatchIO(self.server_socket, MAX_DATAGRAM)
+
+        # Bind to address
+        try:
+            if self.options.verbose:
+                print(f'Binding to {self.options.ip}:{self.options.port}')
+            self.server_socket.bind((self.options.ip, self.options.port))
+        except OSError as e:
+            sys.exit(f'Failed to bind to {self.options.ip}:{self.options.port}, {repr(e)}')
+
+        try:
+            while True:
+                # Send the packages queued while handling the last batch
+                self.flush()
+
+                if self.is_done():
+                    break
+
+                # Wait for packages until the earliest timer is due
+                batch = []
+                wait = self.timers[0][0] - time.monotonic() if self.timers else None
+                if wait is None or wait > 0:
+                    self.server_socket.settimeout(wait)
+                    try:
+                        batch = self.batch_io.receive_into()
+                    except timeout:
+                        pass
+
+                for package, address in batch:
+                    self.dispatch(package, address)
+
+                self.run_timers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close_connections()
+            self.server_socket.close()
+
+        sys.exit(self.error or 0)
+
+    def is_done(self) -> bool:
+        """
+        Check if the server should stop, which is when the first transfer has ended unless options.keep_running is set
+        :return: True if the server should stop, False otherwise
+        """
+        return self.served and not self.connections and not self.options.keep_running
+
+    def close_connections(self) -> None:
+        """
+        Close the files of all connections that are still open, and stop the checkpoint threads
+        """
+        for connection in list(self.connections.values()):
+            connection.close()
+        self.checkpoint_pool.shutdown()
+
+    def dispatch(self, package: memoryview, address: Tuple[str, int]) -> None:
+        """
+        Parse the header of a package and hand it to the connection of the address it came from.
+        A syn from an unknown address starts a new connection, other packages from unknown addresses are dropped.
+        :param package: view of the package in the receive buffer, only valid until the next batch is received
+        :param address: address of the client
+        """
+        if len(package) < HEADER_SIZE:
+            return
+
+        # Parse header in place
+        seq, ack, flags, win = decode_header(package)
+
+        if self.options.verbose:
+            if flags & PARITY_FLAG:
+                package_type = "parity"
+            elif flags & FIN_FLAG:
+                package_type = "fin"
+            elif flags & ACK_FLAG:
+                package_type = "ack"
+            elif flags & SYN_FLAG:
+                package_type = "syn"
+            else:
+                package_type = "data"
+
+            print_in_columns(f"Received {package_type}", f"seq: {seq}")
+
+        if len(package) > HEADER_SIZE:
+            data = package[HEADER_SIZE:]
+        else:
+            data = None
+
+        connection = self.connections.get(address)
+        if connection is None or (flags & SYN_FLAG and connection.state == "finished"):
+            # Only a syn can start a connection, and without keep_running connections are only accepted until the
+            # first transfer has ended
+            if not flags & SYN_FLAG or (self.served and not self.options.keep_running):
+                return
+            connection = Connection(self, address)
+            self.connections[address] = connection
+
+        try:
+            if flags & PARITY_FLAG:
+                # The ack and window fields of a parity package tell which packages it covers
+                connection.receive_parity(seq, ack, win, data)
+            else:
+                connection.handle_package(seq, flags, data)
+        except Exception as e:
+            self.drop(connection, f"Error occurred while receiving data {repr(e)}")
+            return
+        self.schedule(connection)
+
+    def run_timers(self) -> None:
+        """
+        Run the timers of the connections that are due, and drop the connections that timed out
+        """
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, address = heappop(self.timers)
+            connection = self.connections.get(address)
+            if connection is None or connection.scheduled != deadline:
+                continue
+
+            connection.scheduled = None
+            if connection.on_timer(now):
+                self.schedule(connection)
+            elif connection.state == "finished":
+                self.drop(connection)
+            else:
+                self.drop(connection, f"Connection to {address[0]}:{address[1]} timed out")
+
+    def schedule(self, connection: "Connection") -> None:
+        """
+        Add the next deadline of a connection to the timers, unless it is already there
+        :param connection: connection whose state has changed
+        """
+        deadline = connection.next_deadline()
+        if deadline != connection.scheduled:
+            connection.scheduled = deadline
+            heappush(self.timers, (deadline, connection.address))
+
+    def drop(self, connection: "Connection", error: Optional[str] = None) -> None:
+        """
+        Close a connection and forget it
+        :param connection: connection to drop
+        :param error: why the transfer failed, None if it ended normally
+        """
+        connection.close()
+        if self.connections.get(connection.address) is connection:
+            del self.connections[connection.address]
+
+        if error is not None:
+            if self.options.keep_running:
+                print_in_block(error)
+            else:
+                self.error = error
+                self.served = True
+
+    def send(self, package: bytes, address: Tuple[str, int]) -> None:
+        """
+        Queue a package for a client, it is sent with the other packages of the batch before the server waits again
+        :param package: package to send
+        :param address: address of the client
+        """
+        self.queued_packages.append(package)
+        self.queued_addresses.append(address)
+
+    def flush(self) -> None:
+        """
+        Send all queued packages in one batch
+        """
+        if self.queued_packages:
+            self.batch_io.send(self.queued_packages, addresses=self.queued_addresses)
+            self.queued_packages.clear()
+            self.queued_addresses.clear()
+
+    def open_transfer(self, address: Tuple[str, int], file_name: str, size: int, transfer_id: Optional[str],
+                      streams: int, manifest_length: Optional[int] = None, mtime: Optional[int] = None,
+                      compression: Optional[str] = None) -> "Transfer":
+        """
+        Open the file a connection receives. The streams of a parallel transfer share the file of the first stream.
+        :param address: address of the client
+        :param file_name: name of the file sent by the client
+        :param size: size of the whole file in bytes
+        :param transfer_id: id shared by the streams of a parallel transfer, None if the file is sent over one stream
+        :param streams: number of streams the file is sent over
+        :param manifest_length: size of the manifest if the client sends a bundle of files, None for a single file
+        :param mtime: modification time of the file on the client, lets an interrupted transfer of it be resumed
+        :param compression: compression of the data, None if the data is sent as it is
+        :return: the transfer the connection belongs to
+        """
+        key = (address[0], transfer_id if transfer_id is not None else str(address[1]))
+        transfer = self.transfers.get(key)
+        if transfer is None:
+            method = METHOD_NAMES.get(self.options.reliable_method)
+            if manifest_length is not None:
+                print_in_block(f"Receiving files of {file_name} using {method} method")
+            elif streams > 1:
+                print_in_block(f"Receiving file {file_name} using {method} method over {streams} streams")
+            else:
+                print_in_block(f"Receiving file {file_name} using {method} method")
+
+            # Open the file up front, data is written to disk as it arrives
+            if self.options.verbose:
+                print_in_block("Writing file")
+            checkpoint_info = {"size": size, "mtime": mtime, "streams": streams, "compression": compression}
+            receive_name = self.take_over(address, file_name, checkpoint_info)
+            if receive_name is None:
+                receive_name = self.receive_name(file_name, address, manifest_length is not None)
+            transfer = Transfer(key, file_name, receive_name, size, streams, manifest_length, mtime, compression,
+                                self.checkpoint_pool)
+            self.transfers[key] = transfer
+            if transfer.resumed:
+                packages = sum(seq for seq, _, _ in transfer.resumed.values())
+                print_in_block(f"Resuming file {file_name}, packages received before: {packages}")
+        return transfer
+
+    def take_over(self, address: Tuple[str, int], file_name: str, checkpoint_info: Dict[str, object]) -> Optional[str]:
+        """
+        Close a transfer the client has started again, after it crashed or gave up, while the server was still waiting
+        for the earlier one to time out. The earlier transfer is from the same ip, of a file with the same name, size
+        and modification time sent over the same streams. Its connections are forgotten and its checkpoint is saved
+        when it is closed, so the new transfer resumes from it under the same name.
+        :param address: address of the client
+        :param file_name: name of the file sent by the client
+        :param checkpoint_info: size, modification time, number of streams and compression of the file
+        :return: name of the file of the earlier transfer, None if there is no earlier transfer of the file
+        """
+        if checkpoint_info["mtime"] is None:
+            return None
+        for transfer in list(self.transfers.values()):
+            if (transfer.key[0] == address[0] and transfer.file_name == file_name
+                    and transfer.checkpoint_name is not None and transfer.checkpoint_info == checkpoint_info):
+                break
+        else:
+            return None
+
+        print_in_block(f"Closing the earlier transfer of {file_name} from {address[0]}, the client started it again")
+        for connection in [connection for connection in self.connections.values() if connection.transfer is transfer]:
+            del self.connections[connection.address]
+        transfer.close()
+        del self.transfers[transfer.key]
+        return transfer.receive_name
+
+    def end_transfer(self, transfer: "Transfer") -> None:
+        """
+        Forget a transfer that has been received or has failed, and close its file
+        :param transfer: transfer that has ended
+        """
+        transfer.close()
+        if self.transfers.get(transfer.key) is transfer:
+            del self.transfers[transfer.key]
+        self.served = True
+
+    def receive_name(self, file_name: str, address: Tuple[str, int], directory: bool = False) -> str:
+        """
+        Get the name a received file is written to, with "recv" injected in the file name.
+        When the name is already being written by another transfer, the address of the client is added to it.
+        :param file_name: name of the file sent by the client
+        :param address: address of the client
+        :param directory: True if a bundle of files is received into a directory of that name
+        :return: name of the file to write
+        """
+        if directory:
+            name = f"{file_name}-recv"
+            if any(transfer.receive_name == name for transfer in self.transfers.values()):
+                name = f"{file_name}-recv-{address[0]}-{address[1]}"
+            return name
+
+        base, dot, extension = file_name.rpartition(".")
+        if not dot:
+            # The name has no extension, the whole name ends up after "recv"
+            base, extension = "", file_name
+
+        name = f"{base}-recv.{extension}"
+        if any(transfer.receive_name == name for transfer in self.transfers.values()):
+            name = f"{base}-recv-{address[0]}-{address[1]}.{extension}"
+        return name
+
+
+class Transfer:
+    """
+    A file being received, over one connection or over several parallel streams that each carry a range of the file.
+    All streams write to the same preallocated file at their offsets, and the file is complete when every stream has
+    received its fin. A bundle of files is received over one connection and written into a directory.
+
+    Every stream writes its range in order, so what has been received of a range is the packets up to the last one
+    written. That is saved every CHECKPOINT_INTERVAL seconds and when the transfer fails, in a checkpoint next to the
+    file. The periodic checkpoints are saved on a worker thread, which flushes the file to disk before it writes them.
+    When the same file is sent again, the file is kept and every stream continues after its last packet, if it sends
+    packets of the same payload size as before. A client that sends the file again while its interrupted transfer is
+    still open takes that transfer over.
+    """
 
-        # File information
+    def __init__(self, key: Tuple[str, str], file_name: str, receive_name: str, size: int, streams: int,
+                 manifest_length: Optional[int] = None, mtime: Optional[int] = None, compression: Optional[str] = None,
+                 checkpoint_pool: Optional[ThreadPoolExecutor] = None):
+        """
+        Open the file, and resume it if the checkpoint next to it is from the same file sent the same way
+        :param key: ip of the client and id of the transfer
+        :param file_name: name of the file sent by the client
+        :param receive_name: name of the file or directory to write
+        :param size: size of the whole file in bytes
+        :param streams: number of streams the file is sent over
+        :param manifest_length: size of the manifest if a bundle of files is received, None for a single file
+        :param mtime: modification time of the file on the client, None if the transfer can not be resumed
+        :param compression: compression of the data, None if the data is sent as it is
+        :param checkpoint_pool: threads to save checkpoints on, None to save them on the thread that writes the file
+        """
+        self.key = key
+        self.file_name = file_name
+        self.receive_name = receive_name
+        self.streams = streams
+        self.finished_streams = 0
+        self.number_of_acks = 0
+        self.start_time = time.time()
+
+        # Amount of data received in packets and written after decompression
+        self.compression = compression
+        self.payload_bytes = 0
+        self.data_bytes = 0
+
+        # Packages rebuilt from parity packages instead of being resent
+        self.rebuilt = 0
+
+        # Last packet, number of bytes written and payload size of each stream, by the offset of its range
+        self.progress: Dict[int, Tuple[int, int, int]] = {}
+        self.resumed: Dict[int, Tuple[int, int, int]] = {}
+        self.corrupt = False
+        self.checkpoint_name = f"{receive_name}.part"
+        self.checkpoint_info = {"size": size, "mtime": mtime, "streams": streams, "compression": compression}
+        self.checkpoint_deadline = time.monotonic() + CHECKPOINT_INTERVAL
+        self.checkpoint_pool = checkpoint_pool
+        self.pending_checkpoint: Optional[Future] = None
+
+        if manifest_length is not None:
+            self.sink = BundleSink(receive_name, size, manifest_length)
+            self.checkpoint_name = None
+        elif mtime is None:
+            self.sink = FileSink(receive_name, size)
+            self.checkpoint_name = None
+        else:
+            self.resumed = self.load_checkpoint()
+            self.progress = dict(self.resumed)
+            self.sink = FileSink(receive_name, size, truncate=not self.resumed)
+
+    def load_checkpoint(self) -> Dict[int, Tuple[int, int, int]]:
+        """
+        Read the checkpoint of an earlier transfer of the file
+        :return: last packet, number of bytes written and payload size of each stream, empty if there is no
+        checkpoint or it is from another file
+        """
+        try:
+            with open(self.checkpoint_name) as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        if checkpoint.get("file") != self.checkpoint_info or not os.path.isfile(self.receive_name):
+            return {}
+        try:
+            return {int(offset): (seq, length, data_size)
+                    for offset, (seq, length, data_size) in checkpoint["progress"].items()}
+        except (KeyError, TypeError, ValueError):
+            # Checkpoint of an older version
+            return {}
+
+    def start_checkpoint(self) -> None:
+        """
+        Save a checkpoint of the progress so far on a worker thread, unless the last one is still being saved
+        :raises OSError: if the last checkpoint could not be saved
+        """
+        self.checkpoint_deadline = time.monotonic() + CHECKPOINT_INTERVAL
+        if self.pending_checkpoint is not None:
+            if not self.pending_checkpoint.done():
+                return
+            self.pending_checkpoint.result()
+            self.pending_checkpoint = None
+
+        if self.checkpoint_pool is None:
+            self.save_checkpoint(dict(self.progress))
+        else:
+            self.pending_checkpoint = self.checkpoint_pool.submit(self.save_checkpoint, dict(self.progress))
+
+    def save_checkpoint(self, progress: Dict[int, Tuple[int, int, int]]) -> None:
+        """
+        Flush the file to disk and then replace the checkpoint, the checkpoint never covers data that is not on disk
+        :param progress: last packet, number of bytes written and payload size of each stream, taken before the flush
+        """
+        self.sink.sync()
+        checkpoint = {"file": self.checkpoint_info, "progress": progress}
+        with open(f"{self.checkpoint_name}.tmp", "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(f"{self.checkpoint_name}.tmp", self.checkpoint_name)
+
+    def written(self, offset: int, seq: int, length: int, data_size: int) -> None:
+        """
+        Record that a stream has written a packet, and save a checkpoint if it is due
+        :param offset: offset of the range of the stream
+        :param seq: sequence number of the packet
+        :param length: number of bytes of the range written so far
+        :param data_size: payload size of the packets of the stream, the sequence numbers count packets of that size
+        """
+        if self.checkpoint_name is None:
+            return
+        self.progress[offset] = (seq, length, data_size)
+        if time.monotonic() >= self.checkpoint_deadline:
+            self.start_checkpoint()
+
+    def stream_finished(self, number_of_acks: int) -> bool:
+        """
+        Count a stream that has received its fin
+        :param number_of_acks: number of acks sent on the stream
+        :return: True if every stream has finished, False otherwise
+        """
+        self.finished_streams += 1
+        self.number_of_acks += number_of_acks
+        return self.finished_streams == self.streams
+
+    def close(self) -> None:
+        """
+        Close the file. The checkpoint is removed when the file is complete or corrupt, and saved if the transfer
+        failed. Calling close more than once has no effect.
+        """
+        if self.checkpoint_name is not None and not self.sink.closed:
+            if self.pending_checkpoint is not None:
+                # Wait for the checkpoint being saved, it is removed or replaced below
+                self.pending_checkpoint.exception()
+                self.pending_checkpoint = None
+            if self.finished_streams == self.streams or self.corrupt:
+                if os.path.exists(self.checkpoint_name):
+                    os.remove(self.checkpoint_name)
+            elif self.progress:
+                self.save_checkpoint(self.progress)
+        self.sink.close()
+
+
+class Connection:
+    """
+    State machine of one transfer on the server.
+    Every package from the address of the client is handed to handle_package, which moves the connection through its
+    states: handshake (waiting for the syn, after the syns that probe the path MTU), receiving (the syn has been
+    answered and the file is received with the method of the client) and finished (the fin has been received).
+    A finished connection lingers for LINGER_TIME seconds to ack a retransmitted fin in case the ack of the fin was lost.
+    A connection that receives nothing for CONNECTION_TIMEOUT seconds is dropped.
+    """
+    last_valid_seq: int
+
+    def __init__(self, server: Server, address: Tuple[str, int]):
+        """
+        Initialize a connection with a client that has sent a syn
+        :param server: server the connection belongs to
+        :param address: address of the client
+        """
+        self.server = server
+        self.options = server.options
+        self.address = address
+        self.state = "handshake"
+
+        # File information, the transfer the connection belongs to and the offset of its range in the file
         self.file_name = None
-        self.file_buffer = b""
+        self.transfer: Optional[Transfer] = None
+        self.offset = 0
+
+        # Payload size chosen from the path MTU probes of the client, and the number of packets of that size the
+        # buffer has room for
+        self.data_size = DATA_SIZE
+        self.buffer_packets = self.options.buffer_size
+        self.largest_probe = 0
+
+        # Answer to the syn, sent again if the client sends the syn again
+        self.syn_ack: Optional[bytes] = None
+
+        # Hash of the data of the range written so far, and the number of bytes written
+        self.hasher = hashlib.new(DIGEST)
+        self.written_bytes = 0
+
+        # Selective repeat, the reorder window and the sequence number of the fin once it has been received
+        self.window: Optional[ReorderWindow] = None
+        self.fin_seq: Optional[int] = None
+
+        # Forward error correction, rebuilds lost packages from the parity packages of the client
+        self.fec: Optional[ParityDecoder] = None
 
         # Sequence number
         self._current_seq = None
 
+        # Delayed ack, the last ack that was held back, the number of packages it covers and when it must be sent
+        self.pending_ack: Optional[Tuple[int, Optional[int], Optional[bytes]]] = None
+        self.unacked_packages = 0
+        self.ack_deadline = 0.0
+        self.number_of_acks = 0
+
+        # Idle timer, checked when the deadline passes, and the deadline the connection has in the server's timers
+        self.last_activity = time.monotonic()
+        self.idle_deadline = self.last_activity + CONNECTION_TIMEOUT
+        self.scheduled: Optional[float] = None
+
         # Test case
         self.test_can_run = False
         self.skip_ack_generator = yield_true_once()
 
-        # Bind to address
-        try:
-            if args.verbose:
-                print(f'Binding to {args.ip}:{args.port}')
-            self.server_socket.bind((args.ip, args.port))
-        except OSError as e:
-            sys.exit(f'Failed to bind to {args.ip}:{args.port}, {repr(e)}')
-
     def get_next_seq(self) -> int:
         """
         Get next sequence number by incrementing the current sequence number
@@ -67,305 +609,503 @@ class Server:
             self._current_seq += 1
             return self._current_seq
 
-    def start_server(self) -> None:
+    def handle_package(self, seq: int, flags: int, data: Optional[memoryview]) -> None:
         """
-        Perform handshake and start receiving data from the client using the specified method.
-        After receiving the file, write it to disk.
+        Handle a package from the client according to the state of the connection
+        :param seq: sequence number of the package
+        :param flags: flags of the package
+        :param data: data of the package, only valid until the next batch is received
+        :raises Exception: if the transfer can not continue
         """
-        try:
-            # Handshake
-            self.handshake()
-
-            # Receive file name and method
-            try:
-                package, _ = self.server_socket.recvfrom(PACKAGE_SIZE)
-                seq, ack, flags, win = parse_header(package[:12])
-                self.last_valid_seq = seq
-                self.send_ack(seq)
-            except Exception:
-                self.server_socket.close()
-                sys.exit("Did not receive file name and method")
-
-            # Set file name and method
-            data = package[12:].decode()
-            file_name, client_method = data.split(SEP)
-            self.file_name = file_name
-
-            # Check method
-            method = args.reliable_method
-            if client_method != method:
-                raise Exception("Client and server must use the same method")
-
-            print_in_block(f"Receiving file {file_name} using {METHOD_NAMES.get(method)} method")
-
-            self.test_can_run = True
-            start_time = time.time()
-            # Receive file
-            if method == "saw":
-                # Using stop and wait
-                self.stop_and_wait()
-            elif method == "gbn":
-                # Using go back N
-                self.go_back_n()
-            elif method == "sr":
-                # Using selective repeat
-                self.selective_repeat()
-            end_time = time.time()
+        self.last_activity = time.monotonic()
 
-            print_in_block("Finished receiving file")
-
-            # Inject "recv" in file name
-            name_recv_type = ".".join(self.file_name.split(".")[:-1]) + "-recv." + self.file_name.split(".")[-1]
-
-            # Write file
-            with open(name_recv_type, "wb") as file:
-                if args.verbose:
-                    print_in_block("Writing file")
-                file.write(self.file_buffer)
+        if flags & SYN_FLAG:
+            self.handshake(seq, data)
+        elif self.state == "handshake":
+            # The client only sends data after the syn-ack
+            return
+        elif self.options.reliable_method == "saw":
+            self.stop_and_wait(seq, flags, data)
+        elif self.options.reliable_method == "gbn":
+            self.go_back_n(seq, flags, data)
+        elif self.options.reliable_method == "sr":
+            self.selective_repeat(seq, flags, data)
+
+    def handshake(self, seq: int, data: Optional[memoryview]) -> None:
+        """
+        Answer the syn of the client with a syn-ack, and start receiving the file.
+        The syns that probe the path MTU are padded with zeros, and only the size of the largest one is kept. A syn
+        that is sent again is answered with the same syn-ack, because the syn-ack was probably lost.
+        :param seq: sequence number of the package
+        :param data: data of the package, the options block of the client or the padding of a probe
+        :raises Exception: if the transfer is rejected
+        """
+        if data and data[0] == 0:
+            self.largest_probe = max(self.largest_probe, HEADER_SIZE + len(data))
+            return
 
-            # Calculate time
-            time_taken = end_time - start_time
-            # Calculate throughput im mbps
-            throughput = (os.path.getsize(name_recv_type) * 8) / (time_taken * 1000_000)
-            print_in_block(f"Time taken receiving: {time_taken:.2f} seconds", f"Throughput: {throughput:.2f} mbps")
+        if self.syn_ack is None:
+            self.accept(seq, data)
+        self.server.send(self.syn_ack, self.address)
 
-            # Close socket
-            self.server_socket.close()
-            sys.exit(0)
-        except Exception as e:
-            self.server_socket.close()
-            sys.exit(f"Error occurred while receiving data {repr(e)}")
-
-    def handshake(self) -> None:
+    def accept(self, seq: int, data: Optional[memoryview]) -> None:
         """
-        Wait for client to initiate handshake and then perform handshake with client
-        :raises Exception: if handshake fails
+        Read the options of the client, open the file and choose how it is received.
+        The syn-ack acks the last packet of the range the server already has from an earlier transfer, advertises the
+        window and carries the payload size. The client sends data right after it, so there is no ack of the syn-ack.
+        :param seq: sequence number of the syn
+        :param data: options block of the client
+        :raises Exception: if the client does not use the same method as the server, or a version of the options,
+        payload size, compression or forward error correction the server does not support
         """
         try:
-            # Receive syn
-            package, address = self.server_socket.recvfrom(PACKAGE_SIZE)
-            # Save client address for later use
-            self.client_address = address
-            header = parse_header(package[:12])
-            flags = parse_flags(header.flags)
-
-            # Update last valid sequence number
-            self.last_valid_seq = header.seq
-
-            # Check syn
-            if not flags.syn:
-                Exception("Did not receive syn")
+            version, options = decode_options(data)
+        except ValueError:
+            version, options = OPTIONS_VERSION, {}
+        if version != OPTIONS_VERSION:
+            self.reject(f"Unsupported handshake version {version}")
+
+        # Set file name, method and size
+        if not all(key in options for key in ("name", "method", "size")):
+            self.reject("The syn does not carry the name, method and size of the file")
+        self.file_name = os.path.basename(options["name"])
+        file_size = int(options["size"])
+
+        # A stream of a parallel transfer sends the id of the transfer, its index, the number of streams and its range
+        transfer_id, streams = None, 1
+        if "stream" in options:
+            transfer_id, _, streams, offset = options["stream"].split(":")
+            streams, self.offset = int(streams), int(offset)
+
+        # A bundle of files starts with a manifest of the files
+        manifest_length = int(options["manifest"]) if "manifest" in options else None
+
+        # The modification time identifies the file when an interrupted transfer of it is resumed
+        mtime = int(options["mtime"]) if "mtime" in options else None
+
+        # Check method
+        method = self.options.reliable_method
+        if options["method"] != method:
+            self.reject("Client and server must use the same method")
+
+        # Packets of compressed data carry where their data goes, and are decompressed before they are written
+        compression = options.get("compression")
+        if compression not in (None, "zlib"):
+            self.reject(f"Unsupported compression {compression}")
+
+        # With forward error correction the client sends parity packages for every block of data packages, only
+        # selective repeat keeps the packages after a loss to rebuild it from
+        fec_block = int(options["fec"]) if "fec" in options else None
+        if fec_block is not None and (method != "sr" or not 0 < fec_block <= MAX_BLOCK):
+            self.reject(f"Unsupported forward error correction with blocks of {fec_block} packages")
+
+        # The payload is the largest probe that got through, at most the largest the client wants. The buffer holds
+        # the same number of bytes whatever the size, so the window is counted in fewer, larger packets, and never
+        # more than the client can have in flight
+        payload = int(options.get("payload", DATA_SIZE))
+        self.data_size = min(self.largest_probe - HEADER_SIZE if self.largest_probe else DATA_SIZE, payload)
+        if not 0 < self.data_size <= MAX_DATA_SIZE:
+            self.reject(f"Unsupported payload size {self.data_size}")
+        window = int(options.get("window", 0xFFFF))
+        self.buffer_packets = min(max(self.options.buffer_size * DATA_SIZE // self.data_size, 1), max(window, 1),
+                                  0xFFFF)
+        if self.options.verbose:
+            print("Using payload size:", self.data_size)
+
+        self.transfer = self.server.open_transfer(self.address, self.file_name, file_size, transfer_id, streams,
+                                                  manifest_length, mtime, compression)
+
+        # The syn-ack tells the client the last packet of its range the server already has, it continues after it.
+        # The data already written is read back once, to include it in the hash
+        resumed_seq, resumed_bytes, resumed_size = self.transfer.resumed.get(self.offset, (0, 0, self.data_size))
+        if resumed_size != self.data_size:
+            # The path MTU changed, the packets received before do not line up with the packets sent now
+            resumed_seq, resumed_bytes = 0, 0
+        self.hash_written(resumed_bytes)
+        self.last_valid_seq = max(seq, resumed_seq)
+        choices = {"payload": self.data_size}
+        if compression is not None and resumed_bytes:
+            # Compressed packets do not line up with the file, the client compresses the data after this offset
+            choices["resumed"] = resumed_bytes
+        self.syn_ack = create_packet(self.get_next_seq(), self.last_valid_seq, SYN_FLAG | ACK_FLAG,
+                                     self.advertised_window(), encode_options(choices))
+
+        if method == "sr":
+            self.window = ReorderWindow(self.buffer_packets, self.last_valid_seq + 1, self.data_size)
+            if fec_block is not None:
+                self.fec = ParityDecoder(fec_block, self.last_valid_seq + 1)
+
+        self.state = "receiving"
+        self.test_can_run = True
+
+        if self.options.verbose:
+            print("Handshake successful")
 
-            # Send syn-ack
-            packet = create_packet(1, 0, set_flags(syn=True, ack=True), 64, None)
-            self.server_socket.sendto(packet, self.client_address)
+    def reject(self, reason: str) -> None:
+        """
+        Tell the client why the transfer is rejected with a reset, and end it
+        :param reason: why the transfer is rejected
+        :raises Exception: always, with the reason
+        """
+        self.server.send(create_packet(0, 0, RST_FLAG, 0, reason.encode()), self.address)
+        raise Exception(reason)
 
-            # Receive ack
+    def finish(self) -> None:
+        """
+        Start lingering when the fin has been received. When every stream of the file has finished, close the file
+        and print the statistics of the transfer.
+        """
+        end_time = time.time()
+        self.state = "finished"
+        self.idle_deadline = time.monotonic() + LINGER_TIME
+
+        transfer = self.transfer
+        if not transfer.stream_finished(self.number_of_acks):
+            if self.options.verbose:
+                print_in_block(f"Finished stream {transfer.finished_streams} of {transfer.streams}")
+            return
 
-            # Set timeout for receiving ack
-            self.server_socket.settimeout(0.5)
+        print_in_block("Finished receiving file")
 
-            # Receive ack
-            package, _ = self.server_socket.recvfrom(PACKAGE_SIZE)
-            header = parse_header(package[:12])
-            flags = parse_flags(header.flags)
+        # Flush file to disk
+        self.server.end_transfer(transfer)
 
-            # Remove timeout after receiving ack
-            self.server_socket.settimeout(None)
+        # Calculate time
+        time_taken = end_time - transfer.start_time
+        # Calculate throughput im mbps
+        throughput = (transfer.sink.size * 8) / (time_taken * 1000_000)
+        statistics = [f"Time taken receiving: {time_taken:.2f} seconds", f"Throughput: {throughput:.2f} mbps",
+                      f"Number of acks sent: {transfer.number_of_acks}"]
+        if transfer.compression is not None and transfer.payload_bytes:
+            statistics.append(f"Compression ratio: {transfer.data_bytes / transfer.payload_bytes:.2f}")
+        if self.fec is not None:
+            statistics.append(f"Number of packages rebuilt: {transfer.rebuilt}")
+        print_in_block(*statistics)
 
-            # Update last valid sequence number
-            self.last_valid_seq = header.seq
+    def close(self) -> None:
+        """
+        Give up the transfer if the connection is closed before its fin was received, the file can not be completed.
+        Calling close more than once has no effect.
+        """
+        if self.transfer is not None and self.state != "finished":
+            self.server.end_transfer(self.transfer)
 
-            # Check ack
-            if not flags.ack:
-                Exception("Did not receive ack")
+    def write(self, seq: int, data: memoryview) -> None:
+        """
+        Write the data of a package to the file, at its offset in the range of the stream. Compressed packets carry
+        their offset, and are decompressed first.
+        :param seq: sequence number of the package
+        :param data: data of the package
+        """
+        transfer = self.transfer
+        if transfer.compression is None:
+            offset = data_offset(seq, self.data_size)
+        else:
+            transfer.payload_bytes += len(data)
+            offset, data = decode(data)
+            transfer.data_bytes += len(data)
+        transfer.sink.write_at(self.offset + offset, data)
 
-            # Handshake successful
-            if args.verbose:
-                print("Handshake successful")
-        except Exception as e:
-            self.server_socket.close()
-            sys.exit(f"Handshake failed, {repr(e)}")
+        # Data is written in order, so the hash is updated as it is written
+        self.hasher.update(data)
+        self.written_bytes = offset + len(data)
+        transfer.written(self.offset, seq, self.written_bytes, self.data_size)
 
-    def stop_and_wait(self) -> None:
+    def hash_written(self, length: int) -> None:
+        """
+        Hash data of the range that is already in the file, from an earlier transfer that was interrupted
+        :param length: number of bytes at the start of the range
+        """
+        if not length:
+            return
+        with open(self.transfer.receive_name, "rb") as file:
+            file.seek(self.offset)
+            while self.written_bytes < length:
+                chunk = file.read(min(length - self.written_bytes, 1 << 20))
+                if not chunk:
+                    raise Exception("The file is shorter than its checkpoint")
+                self.hasher.update(chunk)
+                self.written_bytes += len(chunk)
+
+    def check_digest(self, digest: Optional[memoryview]) -> None:
+        """
+        Compare the hash the client sent with the fin to the hash of the data written.
+        A client that does not send a hash is not checked.
+        :param digest: hash sent by the client
+        :raises Exception: if the hashes differ, after telling the client with a reset
+        """
+        if not digest:
+            return
+        if bytes(digest) != self.hasher.digest():
+            self.transfer.corrupt = True
+            self.server.send(create_packet(0, self.last_valid_seq, RST_FLAG, 0, b"hash mismatch"), self.address)
+            raise Exception("The file is corrupt, the hash of the data does not match the hash sent by the client")
+        if self.options.verbose:
+            print("The hash of the data matches the hash sent by the client")
+
+    def stop_and_wait(self, seq: int, flags: int, data: Optional[memoryview]) -> None:
         """
-        Receive file using stop and wait method.
-        Receive data from client in a loop and send ack for each package that is received in order.
+        Receive a package using stop and wait method.
+        Send ack for each package that is received in order.
         If a package is received out of order or is a duplicate, send a duplicate ack.
-        Every valid package received is written to the file buffer.
-        Function exits when a package with the fin flag is received.
+        Every valid package received is written to the file at its offset.
+        The transfer is finished when a package with the fin flag is received.
+        :param seq: sequence number of the package
+        :param flags: flags of the package
+        :param data: data of the package
         """
-        # Receive file
-        while True:
-            header, data = self.receive_package()
-            flags = parse_flags(header.flags)
-
-            if header.seq != self.last_valid_seq + 1:
-                # Duplicate or out of order package, send dupack
-                self.send_ack(self.last_valid_seq)
-            else:
-                if data:
-                    # Write data to file buffer
-                    self.file_buffer += data
-                self.send_ack(header.seq)
-                self.last_valid_seq = header.seq
-
-                if flags.fin:
-                    break
-
-    def go_back_n(self) -> None:
+        if seq != self.last_valid_seq + 1:
+            # Duplicate or out of order package, send dupack
+            self.send_ack(self.last_valid_seq)
+        else:
+            if flags & FIN_FLAG:
+                # The fin carries the hash of the data
+                self.check_digest(data)
+            elif data:
+                # Write data to file
+                self.write(seq, data)
+            self.send_ack(seq)
+            self.last_valid_seq = seq
+
+            if flags & FIN_FLAG:
+                self.finish()
+
+    def go_back_n(self, seq: int, flags: int, data: Optional[memoryview]) -> None:
         """
-        Receive file using go back N method. Receives data from client in a loop and sends ack for each package that is
-        received in order. If a package is received out of order or is a duplicate, send a duplicate ack. Every valid
-        package received is written to the file buffer. Function exits when a package with the fin flag is received.
+        Receive a package using go back N method. Packages that are received in order are acked, one ack for every
+        options.delayed_ack packages. If a package is received out of order or is a duplicate, a duplicate ack is sent
+        immediately. Every valid package received is written to the file at its offset. The transfer is finished when
+        a package with the fin flag is received.
 
         This method is very similar to stop and wait, but the client side implementation is different.
+        :param seq: sequence number of the package
+        :param flags: flags of the package
+        :param data: data of the package
         """
-        while True:
-            # Receive packet
-            header, data = self.receive_package()
-            flags = parse_flags(header.flags)
-
-            # Check if packet is duplicate
-            if header.seq == self.last_valid_seq:
-                # Send ack for duplicate packet
-                self.send_ack(header.seq)
-                continue
-
-            # Check if packet is out of order
-            if header.seq != self.last_valid_seq + 1:
-                # Let client go to timeout
-                continue
+        # Check if packet is a duplicate or out of order
+        if seq != self.last_valid_seq + 1:
+            # Send duplicate ack of the last packet received in order
+            self.send_ack(self.last_valid_seq)
+            return
 
-            # Packet is in order
+        # Packet is in order
 
-            # Check if packet is fin
-            if flags.fin:
-                self.send_ack(header.seq)
-                break
+        # Check if packet is fin
+        if flags & FIN_FLAG:
+            # The fin carries the hash of the data
+            self.check_digest(data)
+            self.send_ack(seq)
+            self.last_valid_seq = seq
+            self.finish()
+            return
 
-            # Save data to buffer
-            self.file_buffer += data
+        # Write data to file
+        if data:
+            self.write(seq, data)
 
-            # Update last valid seq
-            self.last_valid_seq = header.seq
+        # Update last valid seq
+        self.last_valid_seq = seq
 
-            # Send ack
-            self.send_ack(header.seq)
+        # Send ack, or hold it back if delayed acks are enabled
+        self.ack_in_order(seq)
 
-    def selective_repeat(self) -> None:
+    def selective_repeat(self, seq: int, flags: int, data: Optional[memoryview]) -> None:
         """
-        Receive file using selective repeat method. Receives data from client in a loop and acknowledges each package
-        that is received in order. If a package is received out of order it is added to a buffer, and the sequence
-        numbers that were skipped are added to a list. When a package is received the list of missing packages is
-        checked and if the package is in the list it is added to the buffer. When a sequence of packages is received
-        without any missing packages, the buffer is written to the file buffer and the list of missing packages is
-        cleared. Function exits when a package with the fin flag is received.
+        Receive a package using selective repeat method. Packages are stored in a fixed size reorder window indexed by
+        sequence number. As soon as the package at the start of the window has arrived, the contiguous run of packages
+        is written to the file and their slots are released.
+        Packages are answered with a cumulative ack of the last package written in order, a SACK bitmap of the
+        packages waiting in the window and the free space in the window, so the client can retire many packages and
+        find the holes from a single ack. Packages outside the window are dropped.
+        Acks of packages received in order can be delayed and coalesced, but when there is a gap, a hole is filled,
+        a package is a duplicate or has the fin flag, the ack is sent immediately.
+        With forward error correction, a package can also complete the group of a parity package, which rebuilds the
+        package missing from the group.
+        The transfer is finished when every package up to and including the one with the fin flag has been written.
+        :param seq: sequence number of the package
+        :param flags: flags of the package
+        :param data: data of the package
         """
-        missing_packages: list[int] = []  # List of missing packages
-        package_buffer: dict[int, Optional[bytes]] = {}  # Buffer to store out-of-order packages
-        received_fin = False
-
-        while True:
-            header, data = self.receive_package()
-            flags = parse_flags(header.flags)
-
-            # Check if in list of missing packages
-            if header.seq in missing_packages:
-                package_buffer[header.seq] = data
-                missing_packages.remove(header.seq)
+        window = self.window
+        fin = flags & FIN_FLAG
 
-                if args.verbose:
-                    print("Received missing package", header.seq)
+        # Gaps, holes being filled, duplicates and packages outside the window are acked immediately
+        ack_now = fin or window.buffered > 0
 
-            # Out of order
-            if header.seq > self.last_valid_seq + 1:
-                # Add skipped packages to missing packages list
-                for i in range(self.last_valid_seq + 1, header.seq):
-                    missing_packages.append(i)
+        if window.insert(seq, data):
+            if self.options.verbose:
+                if seq > window.base:
+                    print("Received package out of order", seq)
+                elif window.buffered > 1:
+                    print("Received missing package", seq)
 
-                if args.verbose:
-                    print("Received package out of order", header.seq)
+            if fin:
+                self.fin_seq = seq
+            elif self.fec is not None and data:
+                self.rebuild(self.fec.received(seq, data))
 
-            # Add package to buffer
-            if data:
-                package_buffer[header.seq] = data
+            self.deliver()
 
-            if flags.fin:
-                received_fin = True
-                self.send_ack(header.seq)
+            if self.options.verbose and window.buffered:
+                print("Number of packages waiting for missing packages", window.buffered)
+        else:
+            # Duplicates and packages outside the window are acked as well, the ack was probably lost or the
+            # package is a window probe
+            ack_now = True
+            if self.options.verbose and seq >= window.base + window.capacity:
+                print("Dropped package outside receiver window", seq)
+
+        if fin or not self.skip_ack():
+            if ack_now or window.buffered > 0:
+                self.send_ack(*self.window_ack())
             else:
-                if not self.skip_ack():
-                    self.send_ack(header.seq)
-                else:
-                    print_in_block(f"Skipped ack {header.seq}")
-
-            if header.seq > self.last_valid_seq:
-                self.last_valid_seq = header.seq
+                self.ack_in_order(*self.window_ack())
+        else:
+            print_in_block(f"Skipped ack {seq}")
 
-            # Check if buffer has missing packages
-            if not missing_packages and package_buffer:
-                # Write to file buffer
-                for i in sorted(package_buffer.keys()):
-                    self.file_buffer += package_buffer[i]
-                package_buffer.clear()
+        if self.state == "receiving" and self.last_valid_seq == self.fin_seq:
+            self.finish()
 
-            # Check if all packages have been received
-            if args.verbose and missing_packages:
-                print("List of missing packages", missing_packages)
+    def receive_parity(self, first: int, fields: int, lengths: int, data: Optional[memoryview]) -> None:
+        """
+        Receive a parity package of a block of data packages, and rebuild the package missing from its group if it is
+        the only one missing. The rebuilt package is written and acked like a package that was received.
+        Parity packages are never acked themselves, and are ignored without forward error correction.
+        :param first: sequence number of the first package of the block
+        :param fields: ack field of the parity package, which packages it covers
+        :param lengths: window field of the parity package, XOR of the lengths of the packages it covers
+        :param data: parity data
+        """
+        if self.state != "receiving" or self.fec is None or not data:
+            return
 
-            if not missing_packages and received_fin:
-                break
+        if self.rebuild(self.fec.parity(first, fields, lengths, data)):
+            self.deliver()
+            self.send_ack(*self.window_ack())
+            if self.last_valid_seq == self.fin_seq:
+                self.finish()
 
-    def receive_package(self) -> Tuple[Header, Union[bytes, None]]:
+    def rebuild(self, packages: List[Tuple[int, bytes]]) -> bool:
         """
-        Receive package from client and parse header.
-        :return: Header and data
+        Store packages rebuilt from parity in the reorder window, like packages that were received
+        :param packages: list of (sequence number, data) of the rebuilt packages
+        :return: True if a package was stored
         """
-        # Receive package
-        package, _ = self.server_socket.recvfrom(PACKAGE_SIZE)
-        # Parse header
-        header = parse_header(package[:12])
-
-        if args.verbose:
-            # Parse flags
-            flags = parse_flags(header.flags)
+        stored = False
+        for seq, data in packages:
+            if self.window.insert(seq, data):
+                stored = True
+                self.transfer.rebuilt += 1
+                if self.options.verbose:
+                    print("Rebuilt package from parity", seq)
+        return stored
+
+    def deliver(self) -> None:
+        """
+        Write the contiguous run of packages starting at the beginning of the reorder window
+        """
+        for delivered_seq, delivered_data in self.window.pop_contiguous():
+            if delivered_seq == self.fin_seq:
+                # The fin carries the hash of the data
+                self.check_digest(delivered_data)
+            elif delivered_data:
+                self.write(delivered_seq, delivered_data)
+            self.last_valid_seq = delivered_seq
+
+        if self.fec is not None:
+            self.fec.forget(self.window.base)
+
+    def window_ack(self) -> Tuple[int, int, bytes]:
+        """
+        Get the ack of the reorder window. The window is counted from the cumulative ack, and the packages waiting in
+        the reorder window for a gap take their slots out of it.
+        :return: the last package written in order, the free space in the window and the SACK bitmap
+        """
+        return self.last_valid_seq, self.advertised_window(), self.window.sack_bitmap(DATA_SIZE)
 
-            if flags.fin:
-                package_type = "fin"
-            elif flags.ack:
-                package_type = "ack"
-            elif flags.syn:
-                package_type = "syn"
-            else:
-                package_type = "data"
+    def advertised_window(self) -> int:
+        """
+        Get the number of packages after the last one written in order the server can take from the client.
+        The receive buffer of the socket is shared by every open connection, so each connection advertises an equal
+        share of it, and with selective repeat at most the free slots of its reorder window. The window is 0 when
+        more connections are open than packages of the payload size fit in the buffer, and the client then probes it.
+        :return: number of packages of the payload size
+        """
+        share = self.options.buffer_size * DATA_SIZE // max(len(self.server.connections), 1) // self.data_size
+        if self.window is not None:
+            return min(self.window.free_slots(), share)
+        return min(self.buffer_packets, share)
 
-            print_in_columns(f"Received {package_type}", f"seq: {header.seq}")
+    def next_deadline(self) -> float:
+        """
+        Get the time the connection next needs to run its timer
+        :return: the earliest of the deadline of a held back ack and the idle deadline
+        """
+        if self.pending_ack is not None:
+            return min(self.ack_deadline, self.idle_deadline)
+        return self.idle_deadline
 
-        if len(package) > 12:
-            data = package[12:]
-        else:
-            data = None
+    def on_timer(self, now: float) -> bool:
+        """
+        Send the held back ack if it is due, and check if the connection has been idle for too long
+        :param now: current time
+        :return: False if the connection timed out or has lingered long enough and should be dropped, True otherwise
+        """
+        if self.pending_ack is not None and self.ack_deadline <= now:
+            self.send_ack(*self.pending_ack)
 
-        return header, data
+        if self.idle_deadline <= now:
+            limit = LINGER_TIME if self.state == "finished" else CONNECTION_TIMEOUT
+            if self.last_activity + limit <= now:
+                return False
+            self.idle_deadline = self.last_activity + limit
+        return True
 
-    def send_ack(self, ack) -> None:
+    def send_ack(self, ack: int, win: Optional[int] = None, sack: Optional[bytes] = None) -> None:
         """
         Send ack to client.
         If the test case is skip_ack, the ack is skipped if the function self.skip_ack() returns true.
         :param ack: the ack number to send
+        :param win: number of packets after the ack number the server can accept, defaults to the advertised window
+        :param sack: SACK bitmap of packets received after ack + 1, sent as the data of the ack
         """
+        # Any ack that was held back is covered by this one
+        self.pending_ack = None
+        self.unacked_packages = 0
+
         # Skip ack if test case is skip_ack and generator returns true (chance)
         if self.skip_ack():
             print_in_block(f"Skipping ack {ack}")
             return
 
-        if args.verbose:
-            print_in_columns("Sending ack", f"ack: {ack}")
+        if win is None:
+            win = self.advertised_window()
+
+        if self.options.verbose:
+            print_in_columns("Sending ack", f"ack: {ack}", f"win: {win}")
 
-        # Send ack
-        package = create_packet(self.get_next_seq(), ack, set_flags(ack=True), 64, None)
-        self.server_socket.sendto(package, self.client_address)
+        # Queue ack, it is sent with the other packages of the batch before the server waits for more packages
+        package = create_packet(self.get_next_seq(), ack, ACK_FLAG, min(win, 0xFFFF), sack)
+        self.server.send(package, self.address)
+        self.number_of_acks += 1
+
+    def ack_in_order(self, ack: int, win: Optional[int] = None, sack: Optional[bytes] = None) -> None:
+        """
+        Ack a package that was received in order.
+        With delayed acks the ack is held back until options.delayed_ack packages are waiting for an ack or ACK_DELAY
+        seconds have passed, and then one cumulative ack is sent for all of them.
+        :param ack: the ack number to send
+        :param win: number of packets after the ack number the server can accept, defaults to the advertised window
+        :param sack: SACK bitmap of packets received after ack + 1
+        """
+        self.unacked_packages += 1
+        if self.unacked_packages >= self.options.delayed_ack:
+            self.send_ack(ack, win, sack)
+            return
+
+        if self.pending_ack is None:
+            self.ack_deadline = time.monotonic() + ACK_DELAY
+        self.pending_ack = (ack, win, sack)
 
     def skip_ack(self) -> bool:
         """
@@ -374,7 +1114,7 @@ class Server:
         Utilizes a generator to return True with a certain chance.
         :return: True if ack should be skipped, False otherwise
         """
-        if args.test_case == "skip_ack":
+        if self.options.test_case == "skip_ack":
             skipping = next(self.skip_ack_generator)
             if skipping:
                 return True
@@ -386,22 +1126,66 @@ class Server:
 
 
 class Client:
-    def __init__(self):
-        self.client_socket = socket(AF_INET, SOCK_DGRAM)
-        self.client_socket.connect((args.ip, args.port))
+    def __init__(self, options: Namespace, filepath: Optional[str] = None, stream: Optional[Stream] = None):
+        """
+        Initialize client using arguments.
+        The transfer does not depend on how packages are received and sent, start_client runs it on a blocking socket.
+        :param options: client options, see arg_parser.parse_args
+        :param filepath: file to send, defaults to the files and directories in options.file
+        :param stream: range of the file to send when it is one of several parallel streams, defaults to the whole file
+        """
+        self.options = options
 
-        # Set blocking to true (necessary on windows)
-        self.client_socket.setblocking(True)
+        # Connection, opened by start_client
+        self.client_socket = None
+        self.batch_io = None
+
+        # Retransmission timeout, starts at 0.5 seconds and is updated from RTT samples of every acked packet
+        self.rto = RtoEstimator(initial=0.5)
 
-        # Default timeout is 0.5 seconds. This is updated during handshake
-        self.client_socket.settimeout(0.5)
-        # Multiplier for timeout (timeout = rtt * multiplier)
-        self.rtt_multiplier = 4
+        # Congestion control of the windowed methods, the window size is the largest window it may use
+        self.congestion_control = CONGESTION_CONTROLLERS[self.options.congestion_control](self.options.window_size)
 
-        # File information
-        self.filepath = args.file
-        self.filename = os.path.basename(self.filepath)
-        self.filesize = os.path.getsize(self.filepath)
+        # Highest sequence number the server has room for, updated from the window advertised on every ack
+        self.send_limit = 0
+
+        # Pacing of new packets, at the rate limit or spread over the RTT. While the transfer waits for the pacer, a
+        # wait without acks is not a timeout
+        self.pacer = Pacer()
+        self.pacing = False
+
+        # Headers of the packets of a batch are packed into reused buffers, released before the next batch is built
+        self.headers = HeaderPool(self.options.window_size)
+
+        # Payload size of the packets, found from the path MTU during the handshake
+        self.data_size = DATA_SIZE
+        self.connected = False
+
+        # File information, a directory or several files are sent as one bundle of files
+        paths = [filepath] if filepath is not None else self.options.file
+        self.filepath = paths[0]
+        self.bundle = None
+        if len(paths) > 1 or os.path.isdir(self.filepath):
+            self.bundle = BundleSource(paths)
+            self.filename = os.path.basename(os.path.normpath(self.filepath)) if len(paths) == 1 else "files"
+            self.filesize = self.bundle.size
+        else:
+            self.filename = os.path.basename(self.filepath)
+            self.filesize = os.path.getsize(self.filepath)
+        self.stream = stream if stream is not None else Stream("", 0, 1, 0, self.filesize)
+
+        # Packets of compressed data, made just ahead of the sender window if compression is enabled
+        self.compressed: Optional[CompressedSource] = None
+        # Number of bytes of the range the server already has from an earlier transfer of compressed data
+        self.resumed_bytes = 0
+
+        # Hash of the data of the range, updated when data is sent the first time and sent to the server with the fin
+        self.hasher = hashlib.new(DIGEST)
+        self.hashed_until = self.stream.offset
+
+        # Forward error correction, parity packets sent after every block of options.fec data packets
+        self.parity = ParityEncoder(self.options.fec) if self.options.fec else None
+        self.number_of_parity_packets = 0
 
         # Maximum number of retries
         self.max_retries = 10
@@ -410,8 +1194,10 @@ class Client:
         self.test_can_run = False
         self.skip_seq_generator = yield_true_once()
 
-        # Count number of timeouts
+        # Count number of timeouts and retransmitted packets, and the packets resent before their timeout
         self.number_of_timeouts = 0
+        self.number_of_retransmissions = 0
+        self.number_of_fast_retransmits = 0
 
         # Sequence number
         self._current_seq = 0
@@ -440,122 +1226,275 @@ class Client:
 
     def start_client(self) -> None:
         """
-        Perform handshake and start sending file to server.
-        Uses the method specified in args.reliable_method.
+        Send the file over one stream, or over options.streams parallel streams.
         """
         try:
-            # Handshake
-            self.handshake()
+            if self.options.streams > 1:
+                self.send_parallel()
+            else:
+                self.send()
+        except Exception as e:
+            # Exit with the error, like the server does, so a failed or rejected transfer is reported
+            sys.exit(f"Error occurred while sending data {e!r}")
+        sys.exit(1)
 
-            # Check method
-            method = args.reliable_method
+    def send(self) -> Tuple[int, int]:
+        """
+        Connect to the server and run the transfer on a blocking socket.
+        :return: number of timeouts and number of retransmissions
+        """
+        self.client_socket = socket(AF_INET, SOCK_DGRAM)
+        self.client_socket.connect((self.options.ip, self.options.port))
 
-            # Send file information
-            if args.verbose:
-                print("Sending file information", f"name:{self.filename} method:{method}")
-            data = f"{self.filename}{SEP}{method}"
-            packet = create_packet(self.current_seq(), 0, set_flags(), 0, data.encode())
-            # Send filename using stop and wait
-            self.stop_and_wait(self.current_seq(), packet)
+        # Set blocking to true (necessary on windows)
+        self.client_socket.setblocking(True)
 
-            print_in_block(f"Sending file {self.filename} using {METHOD_NAMES.get(method)} method")
+        # Batched I/O, used to send a window of packets and to drain queued acks in one call
+        self.batch_io = BatchIO(self.client_socket, PACKAGE_SIZE)
 
-            # Send file
-            self.test_can_run = True
-            start_time = time.time()
-            with open(self.filepath, "rb") as file:
-                # Stop and wait
-                if method == "saw":
-                    if args.verbose:
-                        print_in_block("Stop and wait START")
-
-                    while True:
-                        data = file.read(DATA_SIZE)
-                        if not data:
-                            break
-                        # Send packet using stop and wait
-                        packet = create_packet(self.advance_seq(), 0, set_flags(), 0, data)
-                        self.stop_and_wait(self.current_seq(), packet)
-
-                    # Send fin
-                    self.send_fin()
-                    if args.verbose:
-                        print_in_block("Stop and wait END")
-
-                # Go back N
-                elif method == "gbn":
-                    self.go_back_n(file)
-
-                # Selective repeat
-                elif method == "sr":
-                    self.selective_repeat(file)
-            end_time = time.time()
-
-            # Calculate time
-            time_taken = end_time - start_time
-            # Calculate throughput im mbps
-            throughput = (os.path.getsize(self.filepath) * 8) / (time_taken * 1000_000)
-            print_in_block(f"Time taken sending: {time_taken:.2f} seconds", f"Throughput: {throughput:.2f} mbps",
-                           f"Number of timeouts: {self.number_of_timeouts}")
-
-            print_in_block("Finished sending file")
-        except Exception as e:
-            raise Exception("Error occurred while sending data", repr(e))
+        try:
+            self.run(self.transfer())
         finally:
             # Close connection
             self.client_socket.close()
-            sys.exit(1)
+        return self.number_of_timeouts, self.number_of_retransmissions
 
-    def handshake(self) -> None:
+    def send_parallel(self) -> None:
         """
-        Perform handshake with server.
-        During the handshake the timeout value is set to the RTT * rtt_multiplier.
-        :raises Exception: if handshake fails
+        Split the file into ranges and send every range as its own stream, from a pool of processes that each have
+        their own socket, window and retransmission timer. The server writes every range at its offset in the file.
+        """
+        ranges = split_ranges(self.filesize, self.options.streams)
+        transfer_id = os.urandom(8).hex()
+        print_in_block(f"Sending file {self.filename} over {len(ranges)} streams")
+
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(send_stream, self.options, self.filepath,
+                                   Stream(transfer_id, index, len(ranges), offset, length))
+                       for index, (offset, length) in enumerate(ranges)]
+            # Raises the error of the first stream that failed
+            results = [future.result() for future in futures]
+        end_time = time.time()
+
+        # Calculate time
+        time_taken = end_time - start_time
+        # Calculate throughput im mbps
+        throughput = (self.filesize * 8) / (time_taken * 1000_000)
+        print_in_block(f"Time taken sending: {time_taken:.2f} seconds", f"Throughput: {throughput:.2f} mbps",
+                       f"Number of timeouts: {sum(timeouts for timeouts, _ in results)}",
+                       f"Number of retransmissions: {sum(retransmissions for _, retransmissions in results)}")
+
+        print_in_block("Finished sending file")
+
+    def run(self, transfer: Generator[float, List[Tuple[int, bytes]], None]) -> None:
+        """
+        Drive a transfer with the blocking socket. Every time the transfer asks to wait, the socket waits that long for
+        acks, and the acks are handed back to the transfer.
+        :param transfer: transfer to run
         """
-        if args.verbose:
-            print("Performing handshake")
-
         try:
-            # Send syn
-            packet = create_packet(self.current_seq(), 0, set_flags(syn=True), 0, None)
-            send_time = time.time()
-            self.send_packet(packet)
-
-            # Wait for syn ack
-            ack = self.receive_ack()
-            receive_time = time.time()
-
-            # Calculate and set RTT
-            rtt = receive_time - send_time
-            timeout_value = rtt * self.rtt_multiplier
-            self.client_socket.settimeout(timeout_value)
-            if args.verbose:
-                print("Using timeout value:", timeout_value)
+            wait = next(transfer)
+            while True:
+                self.client_socket.settimeout(wait)
+                wait = transfer.send(self.receive_acks())
+        except StopIteration:
+            pass
+
+    def transfer(self) -> Generator[float, List[Tuple[int, bytes]], None]:
+        """
+        Perform handshake and send the file to server, using the method specified in options.reliable_method.
+        The transfer only sends packets, it does not receive them itself: it yields how long it wants to wait for
+        acks, and is sent the acks that arrived in that time, an empty list if none did. This lets the same transfer
+        run on a blocking socket or on an event loop.
+        :return: generator yielding the time in seconds to wait for acks
+        """
+        # Handshake, the server acks the last packet it already has from an earlier transfer of the file
+        ack = yield from self.handshake()
+
+        # With compression, the range is compressed into packets of the payload size as the sender window reaches
+        # them, after the data the server already has
+        if self.options.compress:
+            source = self.bundle or FileSource(self.filepath)
+            self.compressed = CompressedSource(source, self.stream.offset, self.stream.length, self.data_size,
+                                               hasher=self.hasher, start=self.resumed_bytes, first=ack)
+
+        # Check method
+        method = self.options.reliable_method
+
+        # Continue after the last packet the server already has
+        if ack > self.current_seq():
+            if self.compressed is not None:
+                # The number of packets is not known until the range has been compressed
+                print_in_block(f"Resuming after package {ack}")
+            elif ack >= self.fin_seq():
+                raise Exception(f"Server acked package {ack} after the end of the file")
+            else:
+                print_in_block(f"Resuming after package {ack} of {self.fin_seq() - 1}")
+            self._current_seq = ack
+
+        if self.bundle is not None:
+            print_in_block(f"Sending {len(self.bundle.entries)} files and directories of {self.filename} "
+                           f"using {METHOD_NAMES.get(method)} method")
+        elif self.stream.count > 1:
+            print_in_block(f"Sending stream {self.stream.index + 1} of {self.stream.count} of file {self.filename} "
+                           f"using {METHOD_NAMES.get(method)} method")
+        else:
+            print_in_block(f"Sending file {self.filename} using {METHOD_NAMES.get(method)} method")
 
-            # Check if ack is correct
-            if ack is None or ack != self.current_seq():
-                print(ack, self.current_seq())
-                raise Exception("Did not receive syn:ack")
+        # Send file
+        self.test_can_run = True
+        start_time = time.time()
+        with self.compressed or self.bundle or FileSource(self.filepath) as source:
+            # Stop and wait
+            if method == "saw":
+                if self.options.verbose:
+                    print_in_block("Stop and wait START")
+
+                while self.next_seq() < self.fin_seq(1):
+                    # Send packet using stop and wait
+                    self.headers.release()
+                    seq = self.advance_seq()
+                    yield from self.stop_and_wait(seq, self.build_packet(source, seq, *self.segment(seq)))
+                    self.release(seq + 1)
+
+                # Send fin
+                yield from self.send_fin(source)
+                if self.options.verbose:
+                    print_in_block("Stop and wait END")
+
+            # Go back N
+            elif method == "gbn":
+                yield from self.go_back_n(source)
 
-            # Send ack
-            package = create_packet(self.current_seq(), 0, set_flags(ack=True), 0, None)
-            self.send_packet(package)
+            # Selective repeat
+            elif method == "sr":
+                yield from self.selective_repeat(source)
+        end_time = time.time()
+
+        # Calculate time
+        time_taken = end_time - start_time
+        # Calculate throughput im mbps
+        throughput = (self.stream.length * 8) / (time_taken * 1000_000)
+        statistics = [f"Time taken sending: {time_taken:.2f} seconds", f"Throughput: {throughput:.2f} mbps",
+                      f"Number of timeouts: {self.number_of_timeouts}",
+                      f"Number of retransmissions: {self.number_of_retransmissions}",
+                      f"Number of fast retransmits: {self.number_of_fast_retransmits}",
+                      f"Payload size: {self.data_size} bytes"]
+        if self.parity is not None:
+            statistics.append(f"Number of parity packets: {self.number_of_parity_packets}")
+        if self.compressed is not None and self.compressed.size:
+            statistics.append(f"Compression ratio: {self.compressed.raw_size / self.compressed.size:.2f}")
+            statistics.append(f"Time taken compressing: {self.compressed.compress_time:.2f} seconds")
+        print_in_block(*statistics)
+
+        print_in_block("Finished sending file")
+
+    def handshake(self) -> Generator[float, List[Tuple[int, bytes]], int]:
+        """
+        Perform handshake with server in one round trip, and let the server choose the payload size from the path MTU.
+        Before the syn, the syn is sent padded with zeros to every datagram size the path is probed with, largest
+        first, with the don't fragment bit set. The server keeps the size of the largest one that gets through.
+        The syn carries the options of the transfer: the name and size of the file, the method, the window and largest
+        payload of the client, and the features it asks for. The syn-ack carries the payload size the server chose,
+        at most options.payload_size, advertises the receiver window and acks the last packet the server already has.
+        Data follows the syn-ack right away. The syn is resent until it is answered, with the timeout backed off, and
+        its RTT is the first sample of the retransmission timeout estimator if it was not resent.
+        :return: generator yielding the time in seconds to wait for acks, returning the ack of the syn-ack
+        :raises Exception: if handshake fails
+        """
+        if self.options.verbose:
+            print("Performing handshake")
 
-        except Exception as e:
-            self.client_socket.close()
-            sys.exit(f"Handshake failed {repr(e)}")
+        # Probe the path, the kernel refuses probes larger than the MTU of the route and the path drops the others
+        mode = set_dont_fragment(self.client_socket) if self.options.payload_size > DATA_SIZE else None
+        if mode is not None:
+            for size in probe_sizes(self.client_socket, HEADER_SIZE + self.options.payload_size):
+                try:
+                    self.transmit([create_packet(self.current_seq(), 0, SYN_FLAG, 0, bytes(size - HEADER_SIZE))])
+                except OSError:
+                    pass
+            # Data packets may be fragmented if the path MTU shrinks later on
+            set_dont_fragment(self.client_socket, mode)
+
+        # Options of the transfer
+        options = {"name": self.filename, "method": self.options.reliable_method, "size": self.filesize,
+                   "window": self.options.window_size, "payload": self.options.payload_size}
+        if self.stream.count > 1:
+            # Tell the server which transfer the stream belongs to and where its range starts
+            stream = self.stream
+            options["stream"] = f"{stream.transfer_id}:{stream.index}:{stream.count}:{stream.offset}"
+        if self.bundle is not None:
+            # Tell the server the data is a bundle of files that starts with a manifest
+            options["manifest"] = len(self.bundle.manifest)
+        else:
+            # Lets the server resume an interrupted transfer of the same file
+            options["mtime"] = os.stat(self.filepath).st_mtime_ns
+        if self.options.compress:
+            options["compression"] = "zlib"
+        if self.parity is not None:
+            options["fec"] = self.parity.block
+        if self.options.verbose:
+            print("Sending syn", options)
+        packet = create_packet(self.current_seq(), 0, SYN_FLAG, 0, encode_options(options))
+
+        # Send syn until the syn-ack arrives
+        acks: List[Tuple[int, bytes]] = []
+        for attempt in range(self.max_retries):
+            send_time = time.monotonic()
+            self.send_packet(packet)
 
-        if args.verbose:
+            deadline = send_time + self.rto.timeout
+            while not acks:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                acks = yield wait
+            if acks:
+                break
+            self.rto.backoff()
+        else:
+            raise Exception("Handshake failed, did not receive syn:ack")
+
+        # Update timeout with the RTT of the syn, unless it was resent (Karn's rule)
+        if attempt == 0:
+            self.rto.sample(time.monotonic() - send_time)
+        if self.options.verbose:
+            print("Using timeout value:", self.rto.timeout)
+
+        # Use the payload size the server chose
+        ack, data = acks[0]
+        version, choices = decode_options(data)
+        if version != OPTIONS_VERSION:
+            raise Exception(f"Unsupported handshake version {version}")
+        self.data_size = int(choices.get("payload", DATA_SIZE))
+        if not 0 < self.data_size <= self.options.payload_size:
+            raise Exception(f"Server chose an unsupported payload size {self.data_size}")
+        # Compressed packets do not line up with the file, so the server tells where the data it already has ends
+        self.resumed_bytes = int(choices.get("resumed", 0))
+        if self.options.verbose:
+            print("Using payload size:", self.data_size)
+        self.connected = True
+
+        if self.options.verbose:
             print("Handshake successful")
+        return ack
 
-    def stop_and_wait(self, seq: int, packet: bytes) -> None:
+    def stop_and_wait(self, seq: int, packet: Packet) -> Generator[float, List[Tuple[int, bytes]], int]:
         """
         Send packet to server and wait for ack.
-        Repeat until ack is received.
+        Repeat until ack is received, every time the packet is sent again counts as a retransmission.
+        The timeout is backed off after every timeout,
+        and the RTT is only sampled if the packet was acked without being resent (Karn's rule).
+        Duplicate acks of an earlier packet are ignored, unless DUPLICATE_ACKS of them arrive before the timeout, which
+        resends the packet right away.
         :param seq: sequence number
         :param packet: packet to send
+        :return: generator yielding the time in seconds to wait for acks, returning the ack, which can be higher than
+        seq when the server already has later packets
         """
         retry_limiter = retry_counter(self.max_retries)
+        resent = False
 
         # Wait for ack
         while True:
@@ -563,196 +1502,573 @@ class Client:
             next(retry_limiter)
 
             # Send package
+            if resent:
+                self.number_of_retransmissions += 1
+            send_time = time.monotonic()
             self.send_packet(packet)
 
-            # Receive ack
-            ack = self.receive_ack()
-            if ack == seq:
-                break
+            # Receive ack until the timeout
+            deadline = send_time + self.rto.timeout
+            duplicates = 0
+            while True:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    self.rto.backoff()
+                    break
+
+                acks = yield wait
+                ack = max((ack for ack, _ in acks), default=-1)
+                if ack >= seq:
+                    if not resent:
+                        self.rto.sample(time.monotonic() - send_time)
+                    return ack
+
+                duplicates += len(acks)
+                if duplicates >= DUPLICATE_ACKS:
+                    # Fast retransmit
+                    self.number_of_fast_retransmits += 1
+                    break
+            resent = True
 
-    def go_back_n(self, file: BinaryIO) -> None:
+    def go_back_n(self, source: Source) -> Generator[float, List[Tuple[int, bytes]], None]:
         """
         Send file to server using go back N method.
-        Fill sender window with packets and sends them.
-        Then expects acknowledgments for all packets in the window.
-        If ack is not received in time, all unacknowledged packets in the window are resent.
-        Because the server only accepts packets in order, the ack received is cumulative.
-        :param file:
+        Keeps a sliding window of unacknowledged packets in a deque. The window is limited by the congestion window.
+        Because the server only accepts packets in order, the ack received is cumulative, and every ack that moves the
+        window forward immediately makes room to read and send new packets.
+        A single timer runs for the oldest unacknowledged packet. If it expires, the sender goes back to the oldest
+        packet and resends the window from there, as far as the congestion window allows.
+        The server sends a duplicate ack for every packet after a lost one, so DUPLICATE_ACKS duplicate acks go back
+        without waiting for the timer (fast retransmit). This is a loss and not a timeout: the congestion window is
+        halved instead of restarting slow start, the timeout is not backed off, and later duplicate acks do not go back
+        again until the packets sent before it are acked (fast recovery).
+        With pacing, packets are only sent as fast as the pacer allows, and the sender also wakes up when it does.
+        The window only holds the sequence number, offset and length of each packet, and packets are built from the
+        mapped file every time they are sent.
+        :param source: mapped file to send
+        :return: generator yielding the time in seconds to wait for acks
         """
-        if args.verbose:
+        if self.options.verbose:
             print_in_block("Go back N START")
 
-        window_size = args.window_size
-        sender_window: list[tuple[int, bytes]] = [] 
+        sender_window: deque[tuple[int, int, int]] = deque()  # (seq, offset, length) of unacknowledged packets
+        in_flight = 0  # Number of packets at the start of the window that have been sent since the last timeout
+        highest_sent = self.current_seq()
         done_reading = False
         retry_limiter = retry_counter(self.max_retries)
+        deadline = 0.0  # Retransmission deadline of the oldest packet in the window
+        send_times: dict[int, float] = {}  # Time of first transmission of packets that have not been resent
+        duplicates = 0  # Duplicate acks of the packet before the window
+        recovery_point = self.current_seq()  # Losses of packets up to this seq were already reacted to
 
         while True:
+            # The packets of the last batch have been sent
+            self.headers.release()
+            limit = self.congestion_control.window
+
+            # Fill sender window, as far as the server has room for. If the server has no room and nothing is in flight,
+            # one packet is sent anyway to probe for a window update
+            count = 0 if done_reading else self.send_allowance(len(sender_window), limit)
+            for _ in range(min(count, self.fin_seq(count) - self.current_seq())):
+                seq = self.advance_seq()
+                sender_window.append((seq, *self.segment(seq)))
+            # The window reached the fin packet after the end of the file
+            done_reading = self.current_seq() == self.fin_seq()
+
+            # Send the packets in the window that have not been sent since the last timeout, in one batch, as far as
+            # the pacer allows
+            batch: list[Packet] = []
+            ready = min(len(sender_window), limit)
+            paced = min(ready, in_flight + self.pacing_allowance())
+            while in_flight < paced:
+                seq, offset, length = sender_window[in_flight]
+
+                # Start the timer if this is the oldest unacknowledged packet
+                if in_flight == 0:
+                    deadline = time.monotonic() + self.rto.timeout
+
+                if seq <= highest_sent:
+                    self.number_of_retransmissions += 1
+                else:
+                    send_times[seq] = time.monotonic()
+                    highest_sent = seq
+                batch.append(self.build_packet(source, seq, offset, length))
+                in_flight += 1
+            self.send_packets(batch)
+
             if not sender_window and done_reading:
                 break
 
-            # Fill sender window
-            if len(sender_window) < window_size and not done_reading:
-                # Read data from file
-                data = file.read(DATA_SIZE)
-
-                if data:
-                    # Add data packet to sender window
-                    packet = create_packet(self.advance_seq(), 0, set_flags(), window_size, data)
-                else:
-                    # If we reached the end of the file create fin packet
-                    packet = create_packet(self.advance_seq(), 0, set_flags(fin=True), window_size, None)
-                    done_reading = True
+            # Wait for an ack until the timer of the oldest packet expires, or until the pacer lets the rest of the
+            # window be sent
+            wait = deadline - time.monotonic() if in_flight else math.inf
+            if wait > 0:
+                pace = self.pacer.delay() if in_flight < ready else math.inf
+                self.pacing = pace < wait
+                acks = yield min(wait, pace)
+                self.pacing = False
+
+                # Acks are cumulative, so only the highest ack of the batch matters
+                ack = max(ack for ack, _ in acks) if acks else None
+                if ack is not None and ack >= sender_window[0][0]:
+                    # Take an RTT sample from the acked packet, unless it was resent (Karn's rule)
+                    if ack in send_times:
+                        self.rto.sample(time.monotonic() - send_times[ack])
+
+                    # Ack is cumulative, so remove all packets with seq number less than or equal to ack
+                    acked = 0
+                    while sender_window and sender_window[0][0] <= ack:
+                        send_times.pop(sender_window.popleft()[0], None)
+                        acked += 1
+                    self.release(sender_window[0][0] if sender_window else self.next_seq())
+                    in_flight = max(in_flight - acked, 0)
+                    self.congestion_control.on_ack(acked, self.rto.srtt)
+
+                    # The window moved, restart the timer and the retry counter
+                    deadline = time.monotonic() + self.rto.timeout
+                    retry_limiter = retry_counter(self.max_retries)
+                    duplicates = sum(1 for duplicate, _ in acks if duplicate == ack) - 1
+                elif ack is not None and ack == sender_window[0][0] - 1:
+                    duplicates += sum(1 for duplicate, _ in acks if duplicate == ack)
+                    if duplicates >= DUPLICATE_ACKS and ack >= recovery_point:
+                        # Fast retransmit, go back to the oldest unacknowledged packet
+                        self.number_of_fast_retransmits += 1
+                        self.congestion_control.on_loss()
+                        recovery_point = highest_sent
+                        send_times.clear()
+                        in_flight = 0
+                        duplicates = 0
+                continue
 
-                # Add packet to sender window and send packet
-                sender_window.append((self.current_seq(), packet))
-            else:
-                # Sender window is full or we are done reading
-
-                # Send all packets in sender window
-                for seq, packet in sender_window:
-                    self.send_packet(packet)
-
-                while sender_window:
-                    ack = self.receive_ack()
-                    if ack is not None:
-                        # Ack is cumulative, so remove all packets with seq number less than or equal to ack
-                        while sender_window and sender_window[0][0] <= ack:
-                            # Remove acked packages from sender window
-                            sender_window.pop(0)
-                    else:
-                        next(retry_limiter)
-                        break
-        if args.verbose:
+            # Timeout, go back to the oldest unacknowledged packet
+            next(retry_limiter)
+            self.rto.backoff()
+            self.congestion_control.on_timeout()
+            send_times.clear()
+            in_flight = 0
+            duplicates = 0
+            recovery_point = highest_sent
+
+        if self.options.verbose:
             print_in_block("Go back N END")
 
-    def selective_repeat(self, file: BinaryIO) -> None:
+    def selective_repeat(self, source: Source) -> Generator[float, List[Tuple[int, bytes]], None]:
         """
         Send file to server using selective repeat method.
-        Fills sender window with packets and sends them.
-        Waits for ack for each packet in the window.
-        If ack is not received in time, only the unacknowledged packet is resent.
-        :param file:
+        Keeps the sender window filled with packets up to the congestion window, and every packet that is sent gets its
+        own retransmission deadline.
+        The deadlines are kept in a heap, so the socket only waits until the earliest deadline.
+        Every ack carries a cumulative ack and a SACK bitmap. All packets the ack covers are removed from the window
+        and new packets are read and sent immediately. Packets with at least three received packets after them are
+        considered lost and resent right away. When a deadline expires, only that packet is resent.
+        With forward error correction, the parity packets of every block are sent right after its last packet, and a
+        lost packet is only resent when the server has received packets after its block and has not rebuilt it.
+        With pacing, new packets are only sent as fast as the pacer allows, and the sender also wakes up when it does.
+        Resent packets are not held back, but take their share of the rate from the new packets.
+        The window only holds the offset and length of each packet, and packets are built from the mapped file every
+        time they are sent.
+        :param source: mapped file to send
+        :return: generator yielding the time in seconds to wait for acks
         """
-        if args.verbose:
+        if self.options.verbose:
             print_in_block("Selective repeat START")
 
-        window_size = args.window_size
-        sender_window: dict[int, bytes] = {}
+        sender_window: dict[int, tuple[int, int]] = {}  # Offset and length of each packet in the window
+        retries: dict[int, int] = {}  # Number of times each packet in the window has been resent
+        send_times: dict[int, float] = {}  # Time of first transmission of each packet in the window
+        deadlines: dict[int, float] = {}  # Current retransmission deadline of each packet in the window
+        timers: list[tuple[float, int]] = []  # Heap of (deadline, seq), outdated entries are skipped lazily
+        scoreboard = SackScoreboard(self.next_seq())
+        recovery_point = self.current_seq()  # Losses of packets up to this seq were already reacted to
         done_reading = False
+        first_seq = self.next_seq()  # Blocks that start before this seq were sent before a resume, and get no parity
+        held: set[int] = set()  # Lost packets the parity packets of their block may still rebuild
 
         while True:
             # Return if we are done reading and sender window is empty
             if not sender_window and done_reading:
                 break
 
-            # Fill sender window
-            while len(sender_window) < window_size and not done_reading:
+            # The packets of the last batch have been sent
+            self.headers.release()
+
+            # Fill sender window up to the congestion window and as far as the server has room for, and send the new
+            # packets in one batch. If the server has no room and nothing is in flight, one packet is sent anyway to
+            # probe for a window update, and its retransmission timer keeps probing until the window opens
+            count = 0 if done_reading else self.send_allowance(len(sender_window), self.congestion_control.window)
+            count = min(count, self.fin_seq(count) - self.current_seq())
+            # The packets the pacer does not allow yet are sent when it does
+            paced = min(count, self.pacing_allowance())
+            if paced:
+                # Add packets to sender window and start their timers
+                batch: list[Packet] = []
+                now = time.monotonic()
+                for _ in range(paced):
+                    seq = self.advance_seq()
+                    sender_window[seq] = self.segment(seq)
+                    retries[seq] = 0
+                    send_times[seq] = now
+                    deadlines[seq] = now + self.rto.timeout
+                    heappush(timers, (deadlines[seq], seq))
+                    batch.append(self.build_packet(source, seq, *sender_window[seq]))
+
+                    # Send the parity packets of a block after its last packet
+                    fin_seq = self.fin_seq()
+                    if self.parity is not None and seq < fin_seq and (seq % self.parity.block == 0
+                                                                      or seq == fin_seq - 1):
+                        first = block_start(seq, self.parity.block)
+                        if first >= first_seq:
+                            batch.extend(self.build_parity(source, first, seq))
+                self.send_packets(batch)
+
+                # The window reached the fin packet after the end of the file
+                done_reading = self.current_seq() == self.fin_seq()
+
+            # Drop timers of packets that have been acked or resent since the timer was set
+            while timers and deadlines.get(timers[0][1]) != timers[0][0]:
+                heappop(timers)
+
+            to_resend: list[int] = []
+
+            # Wait for an ack until the earliest deadline, or until the pacer lets the packets held back be sent
+            wait = timers[0][0] - time.monotonic() if timers else math.inf
+            if wait > 0:
+                pace = self.pacer.delay() if paced < count else math.inf
+                self.pacing = pace < wait
+                acks = yield min(wait, pace)
+                self.pacing = False
+                if acks:
+                    # Remove every packet covered by the cumulative acks or the SACK bitmaps of the batch
+                    acked = 0
+                    newest_send_time = None
+                    for ack, sack in acks:
+                        for seq in scoreboard.update(ack, sack):
+                            if seq not in sender_window:
+                                continue
+                            # Only packets that were not resent can be used as RTT samples (Karn's rule)
+                            if retries[seq] == 0:
+                                newest_send_time = send_times[seq]
+                            del sender_window[seq]
+                            del retries[seq]
+                            del send_times[seq]
+                            del deadlines[seq]
+                            acked += 1
+
+                    if newest_send_time is not None:
+                        self.rto.sample(time.monotonic() - newest_send_time)
+                    if acked:
+                        self.congestion_control.on_ack(acked, self.rto.srtt)
+                        self.release(scoreboard.base)
+
+                    # Resend packets the SACK bitmap shows are lost without waiting for their timers
+                    lost = scoreboard.lost()
+                    if self.parity is not None:
+                        # Wait for the parity packets, which were sent right after the last packet of the block
+                        self.parity.observe(acked, len(lost))
+                        held = {seq for seq in held.union(lost) if seq in sender_window}
+                        fin_seq = self.fin_seq()
+                        lost = sorted(seq for seq in held if scoreboard.highest >= min(
+                            block_start(seq, self.parity.block) + self.parity.block, fin_seq))
+                        held.difference_update(lost)
+                    for seq in lost:
+                        if seq not in sender_window:
+                            continue
+                        if seq > recovery_point:
+                            # First loss in this window of data
+                            self.congestion_control.on_loss()
+                            recovery_point = self.current_seq()
+                        self.number_of_fast_retransmits += 1
+                        to_resend.append(seq)
+
+            # Find the packets whose deadline has expired
+            now = time.monotonic()
+            expired = False
+            while timers and timers[0][0] <= now:
+                deadline, seq = heappop(timers)
+                if deadlines.get(seq) != deadline or seq in to_resend:
+                    continue
+                if not expired:
+                    # Back off once for every timeout, not once for every packet that expired at the same time
+                    self.rto.backoff()
+                    expired = True
+                if retries[seq] > 0:
+                    # The packet was lost again after being resent, nothing is getting through
+                    self.congestion_control.on_timeout()
+                    recovery_point = self.current_seq()
+                elif seq > recovery_point:
+                    # First loss in this window of data
+                    self.congestion_control.on_loss()
+                    recovery_point = self.current_seq()
+                to_resend.append(seq)
+
+            # Resend lost packets in one batch and restart their timers
+            for seq in to_resend:
+                held.discard(seq)
+                retries[seq] += 1
+                if retries[seq] > self.max_retries:
+                    raise Exception(f"Retries limit reached for packet {seq}")
+                self.number_of_retransmissions += 1
+                deadlines[seq] = now + self.rto.timeout
+                heappush(timers, (deadlines[seq], seq))
+            self.send_packets([self.build_packet(source, seq, *sender_window[seq]) for seq in to_resend])
+
+        if self.options.verbose:
+            print_in_block("Selective repeat END")
 
-                # Read data from file
-                data = file.read(DATA_SIZE)
+    def fin_seq(self, ahead: int = 0) -> int:
+        """
+        Get the sequence number of the fin packet, which follows the last data packet.
+        With compression, the number of packets is only known once the range has been compressed, so the data of the
+        next packets is compressed first, and until the end is reached the fin packet is taken to be after all of them.
+        :param ahead: number of packets after the current one the sender wants to send
+        :return: sequence number of the fin packet
+        """
+        if self.compressed is not None:
+            self.compressed.extend(self.current_seq() + ahead)
+            return self.compressed.count + 1 if self.compressed.done else sys.maxsize
+        return (self.stream.length + self.data_size - 1) // self.data_size + 1
 
-                if not data:
-                    # Create fin packet if we reached the end of the file
-                    packet = create_packet(self.advance_seq(), 0, set_flags(fin=True), window_size, None)
-                    done_reading = True
-                else:
-                    # Create data packet
-                    packet = create_packet(self.advance_seq(), 0, set_flags(), window_size, data)
-
-                # Add packet to sender window
-                sender_window[self.current_seq()] = packet
-
-            # Send all packets in sender window
-            for seq, packet in sender_window.items():
-                self.send_packet(packet)
-
-            # Receive ack and remove acked packages from sender window
-            while sender_window:
-                ack = self.receive_ack()
-                if ack is not None:
-                    if ack in sender_window:
-                        del sender_window[ack]
-                    else:
-                        continue
-                else:
-                    break
+    def segment(self, seq: int) -> Tuple[int, int]:
+        """
+        Get the part of the file a data packet carries, inside the range of the stream
+        :param seq: sequence number of the packet
+        :return: offset and length of the data, the length is 0 for the fin packet
+        """
+        if self.compressed is not None:
+            # Index and length of the compressed packet
+            return self.compressed.segment(seq - 1)
+        offset = self.stream.offset + data_offset(seq, self.data_size)
+        end = self.stream.offset + self.stream.length
+        return offset, max(min(self.data_size, end - offset), 0)
+
+    def release(self, seq: int) -> None:
+        """
+        Forget the compressed packets before a sequence number, the server has them and they are not sent again.
+        With forward error correction, the packets of the block being sent are kept for its parity packets.
+        :param seq: sequence number of the first packet that may still be sent
+        """
+        if self.compressed is None:
+            return
+        if self.parity is not None:
+            seq = min(seq, block_start(self.next_seq(), self.parity.block))
+        self.compressed.release(seq - 1)
 
-        if args.verbose:
-            print_in_block("Selective repeat END")
+    def build_packet(self, source: Source, seq: int, offset: int, length: int) -> Packet:
+        """
+        Build a packet from the mapped file, as a header and a view of the data that are gathered when it is sent,
+        so the data is never copied. The header is packed into the header pool, and is valid until it is released. A packet without data is the fin packet, which carries the hash of the data.
+        :param source: mapped file or bundle of files
+        :param seq: sequence number of the packet
+        :param offset: offset of the data in the file
+        :param length: length of the data
+        :return: header and data of the packet
+        """
+        if self.compressed is None:
+            self.hash_until(source, offset + length)
+        if length == 0:
+            return self.headers.encode(seq, 0, FIN_FLAG, self.options.window_size), memoryview(self.hasher.digest())
+        return self.headers.encode(seq, 0, 0, self.options.window_size), source.read_at(offset, length)
+
+    def build_parity(self, source: Source, first: int, last: int) -> List[Packet]:
+        """
+        Build the parity packets of a block of data packets. The ack field of a parity packet tells which packets it
+        covers, and the window field carries the XOR of their lengths.
+        :param source: mapped file or bundle of files
+        :param first: sequence number of the first packet of the block
+        :param last: sequence number of the last packet of the block
+        :return: parity packets
+        """
+        chunks = [source.read_at(*self.segment(seq)) for seq in range(first, last + 1)]
+        packets = [(self.headers.encode(first, fields, PARITY_FLAG, lengths), memoryview(data))
+                   for fields, lengths, data in self.parity.encode(chunks)]
+        self.number_of_parity_packets += len(packets)
+        return packets
+
+    def hash_until(self, source: Source, end: int) -> None:
+        """
+        Hash the data of the range up to an offset, if it has not been hashed yet. This is the data of a packet that
+        is sent the first time, and the data the server already had when a transfer is resumed.
+        Compressed data is hashed when it is compressed instead.
+        :param source: mapped file or bundle of files
+        :param end: offset in the file to hash up to
+        """
+        end = min(end, self.stream.offset + self.stream.length)
+        while self.hashed_until < end:
+            chunk = source.read_at(self.hashed_until, min(end - self.hashed_until, 1 << 20))
+            self.hasher.update(chunk)
+            self.hashed_until += len(chunk)
+
+    def send_allowance(self, in_flight: int, limit: int) -> int:
+        """
+        Get the number of new packets the congestion window and the receiver window allow sending.
+        When nothing is in flight a packet may always be sent, so a closed window is probed instead of waited on.
+        :param in_flight: number of packets sent but not acknowledged
+        :param limit: congestion window
+        :return: number of new packets that may be sent
+        """
+        allowed = min(limit - in_flight, self.send_limit - self.current_seq())
+        if in_flight == 0:
+            return max(allowed, 1)
+        return max(allowed, 0)
 
-    def send_fin(self) -> None:
+    def pacing_allowance(self) -> int:
+        """
+        Update the pacing rate and get the number of new packets the pacer allows sending now.
+        The pacing rate is the lowest of the rate limit, shared by the parallel streams, and with options.pacing the
+        congestion window sent over one smoothed RTT, times a gain so the window can still grow.
+        :return: number of new packets that may be sent, unlimited if packets are not paced
+        """
+        packet_size = HEADER_SIZE + self.data_size
+        rates = []
+        if self.options.rate_limit:
+            rates.append(self.options.rate_limit * 1_000_000 / 8 / self.stream.count)
+        if self.options.pacing and self.rto.srtt:
+            control = self.congestion_control
+            gain = SLOW_START_PACING_GAIN if control.cwnd < control.ssthresh else PACING_GAIN
+            rates.append(gain * control.window * packet_size / self.rto.srtt)
+        self.pacer.set_rate(min(rates) if rates else None, packet_size)
+        return self.pacer.allowance(packet_size)
+
+    def send_fin(self, source: Source) -> Generator[float, List[Tuple[int, bytes]], None]:
         """
         Send fin packet to server using stop and wait method.
+        :param source: mapped file or bundle of files
+        :return: generator yielding the time in seconds to wait for acks
         """
         # Send fin
-        packet = create_packet(self.advance_seq(), 0, set_flags(fin=True), 0, None)
-        self.stop_and_wait(self.current_seq(), packet)
+        self.headers.release()
+        seq = self.advance_seq()
+        yield from self.stop_and_wait(seq, self.build_packet(source, seq, *self.segment(seq)))
 
-    def send_packet(self, packet: bytes) -> None:
+    def send_packet(self, packet: Packet) -> None:
         """
         Send packet to server.
-        Uses skip_seq to skip sending a packet is the skip_seq test case is active.
         :param packet: packet to send
         """
-        # Test case to skip seq
-        if self.skip_seq():
-            header = parse_header(packet[:12])
-            # Create corrupted packet with next sequence number
-            if args.verbose:
-                print_in_block(f"Skipping packet with seq {header.seq}")
+        self.send_packets([packet])
+
+    def send_packets(self, packets: List[Packet]) -> None:
+        """
+        Send packets to server in one batch.
+        Uses skip_seq to skip sending a packet is the skip_seq test case is active.
+        :param packets: packets to send, in order
+        """
+        if not packets:
             return
 
-        # Send packet
-        self.client_socket.sendall(packet)
+        # Packets that are skipped by the test case are paced like lost packets
+        self.pacer.consume(sum(len(packet[0]) + len(packet[1]) if isinstance(packet, tuple) else len(packet)
+                               for packet in packets))
 
-        if args.verbose:
-            header = parse_header(packet[:12])
-            flags = parse_flags(header.flags)
+        # Test case to skip seq
+        if self.options.test_case == "skip_seq":
+            kept = []
+            for packet in packets:
+                if self.skip_seq():
+                    header = parse_header(packet[0] if isinstance(packet, tuple) else packet)
+                    # Create corrupted packet with next sequence number
+                    if self.options.verbose:
+                        print_in_block(f"Skipping packet with seq {header.seq}")
+                else:
+                    kept.append(packet)
+            packets = kept
+
+        # Send packets
+        self.transmit(packets)
+
+        if self.options.verbose:
+            for packet in packets:
+                header = parse_header(packet[0] if isinstance(packet, tuple) else packet)
+                flags = parse_flags(header.flags)
+
+                if header.flags & PARITY_FLAG:
+                    package_type = "parity"
+                elif flags.fin:
+                    package_type = "fin"
+                elif flags.ack:
+                    package_type = "ack"
+                elif flags.syn:
+                    package_type = "syn"
+                else:
+                    package_type = "data"
 
-            if flags.fin:
-                package_type = "fin"
-            elif flags.ack:
-                package_type = "ack"
-            elif flags.syn:
-                package_type = "syn"
-            else:
-                package_type = "data"
+                print_in_columns(f"Sending {package_type}", f"seq: {header.seq}")
 
-            print_in_columns(f"Sending {package_type}", f"seq: {header.seq}")
+    def transmit(self, packets: List[Packet]) -> None:
+        """
+        Send packets on the blocking socket, in one batch
+        :param packets: packets to send, in order
+        """
+        self.batch_io.send(packets)
 
-    def receive_ack(self) -> Union[int, None]:
+    def receive_acks(self) -> List[Tuple[int, bytes]]:
         """
-        Receive ack from server.
-        If the socket times out, the timeout counter is increased.
-        :return: the ack number or None if no ack was received
-        :raises Exception: if received package does not have ack flag
+        Wait for an ack from server on the blocking socket and then drain all acks that are already queued, in one
+        batch.
+        :return: list of (ack number, SACK bitmap), empty if no ack was received
+        :raises Exception: if a received package does not have ack flag
         """
         try:
-            # Receive package from server
-            package = self.client_socket.recv(PACKAGE_SIZE)
-            seq, ack, flags, win = parse_header(package[:12])
-            flags = parse_flags(flags)
-
-            if flags.ack:
-                if args.verbose:
-                    if flags.syn:
-                        print_in_columns(f"Received syn:ack", f"ack: {ack}")
-                    elif flags.fin:
-                        print_in_columns(f"Received fin:ack", f"ack: {ack}")
-                    else:
-                        print_in_columns(f"Received ack", f"ack: {ack}")
-
-                return ack
-            raise Exception("Received package without ack flag")
-        except Exception as e:
-            if isinstance(e, OSError):
+            packages = [package for package, _ in self.batch_io.receive()]
+        except OSError:
+            packages = []
+        return self.parse_acks(packages)
+
+    def parse_acks(self, packages: List[bytes]) -> List[Tuple[int, bytes]]:
+        """
+        Parse the acks received from server in one batch.
+        The send limit is updated from the receiver window advertised on each ack.
+        If no ack was received, the timeout counter is increased.
+        :param packages: packages received from server
+        :return: list of (ack number, SACK bitmap), empty if no ack was received
+        :raises Exception: if a received package does not have ack flag
+        """
+        if not packages:
+            # Waiting for the pacer is not a timeout
+            if not self.pacing:
                 print("Timeout while receiving package")
                 self.number_of_timeouts += 1
-            else:
-                raise Exception("Error while receiving package", repr(e))
+            return []
+
+        try:
+            acks = [self.parse_ack(package) for package in packages]
+        except Exception as e:
+            raise Exception("Error while receiving package", repr(e))
+        return [ack for ack in acks if ack is not None]
+
+    def parse_ack(self, package: bytes) -> Optional[Tuple[int, bytes]]:
+        """
+        Parse an ack from server and update the send limit from the advertised receiver window.
+        :param package: package received from server
+        :return: the ack number and the SACK bitmap carried by the ack, None for a syn-ack after the handshake
+        :raises Exception: if the package does not have ack flag
+        """
+        seq, ack, flags, win = parse_header(package[:12])
+        if flags & RST_FLAG:
+            raise Exception(f"Server rejected the file: {bytes(package[HEADER_SIZE:]).decode(errors='replace')}")
+        flags = parse_flags(flags)
+
+        if not flags.ack:
+            raise Exception("Received package without ack flag")
+
+        if flags.syn and self.connected:
+            # Answer to a syn that was sent again
             return None
 
+        # The server can accept win packets after the acked one. Acks can be reordered, so the limit never
+        # moves backwards
+        self.send_limit = max(self.send_limit, ack + win)
+
+        if self.options.verbose:
+            if flags.syn:
+                print_in_columns(f"Received syn:ack", f"ack: {ack}")
+            elif flags.fin:
+                print_in_columns(f"Received fin:ack", f"ack: {ack}")
+            else:
+                print_in_columns(f"Received ack", f"ack: {ack}")
+
+        return ack, package[HEADER_SIZE:]
+
     def skip_seq(self) -> bool:
         """
         Test case to skip sending a packet.
@@ -762,7 +2078,7 @@ class Client:
         if not self.test_can_run:
             return False
 
-        if args.test_case == "skip_seq":
+        if self.options.test_case == "skip_seq":
             skipping = next(self.skip_seq_generator)
             if skipping:
                 return True
@@ -773,6 +2089,49 @@ class Client:
 """ UTILITY FUNCTIONS """
 
 
+def send_stream(options, filepath: str, stream: Stream) -> Tuple[int, int]:
+    """
+    Send one stream of a parallel transfer, run in a process of the pool
+    :param options: client options, processes that do not fork have not parsed them
+    :param filepath: file to send
+    :param stream: range of the file to send
+    :return: number of timeouts and number of retransmissions
+    """
+    return Client(options, filepath, stream).send()
+
+
+def split_ranges(size: int, streams: int) -> List[Tuple[int, int]]:
+    """
+    Split a file into ranges of whole packets, one for each stream.
+    A small file gets fewer streams, no stream is left without data unless the file is empty.
+    :param size: size of the file in bytes
+    :param streams: number of streams wanted
+    :return: list of (offset, length)
+    """
+    packets = max((size + DATA_SIZE - 1) // DATA_SIZE, 1)
+    streams = min(streams, packets)
+    ranges = []
+    for index in range(streams):
+        first = packets * index // streams
+        last = packets * (index + 1) // streams
+        offset = first * DATA_SIZE
+        ranges.append((offset, min(last * DATA_SIZE, size) - offset))
+    return ranges
+
+
+def grow_receive_buffer(sock, size: int) -> None:
+    """
+    Make the receive buffer of a socket at least a number of bytes, as far as the system allows
+    :param sock: UDP socket
+    :param size: number of bytes wanted
+    """
+    try:
+        if sock.getsockopt(SOL_SOCKET, SO_RCVBUF) < size:
+            sock.setsockopt(SOL_SOCKET, SO_RCVBUF, size)
+    except OSError:
+        pass
+
+
 def print_in_block(*args):
     """
     Prints data in a block.
@@ -834,16 +2193,26 @@ def yield_true_once() -> Generator[bool, None, None]:
         yield False
 
 
+def data_offset(seq: int, data_size: int) -> int:
+    """
+    Get the offset in the file of the data carried by a package.
+    The first data package has sequence number 1.
+    :param seq: sequence number of the package
+    :param data_size: payload size of the packages of the transfer
+    :return: offset in bytes from the start of the file
+    """
+    return (seq - 1) * data_size
+
+
 def parse_header(header: bytes) -> Header:
     """
     Takes a header of 12 bytes as an argument,
-    unpacks the value based on the constant HEADER_FORMAT
+    unpacks the value with the precompiled header struct
     and returns a named tuple with the values
     :param header: 12 bytes header
     :return: parsed header as a named tuple Header
     """
-    seq, ack, flags, win = unpack(HEADER_FORMAT, header)
-    return Header(seq, ack, flags, win)
+    return Header(*decode_header(header))
 
 
 def parse_flags(flags: int) -> Flags:
@@ -859,10 +2228,9 @@ def parse_flags(flags: int) -> Flags:
     # We only parse the first 3 fields because we're not
     # using reset flag in our implementation
 
-    syn = flags & (1 << 3)  # 1 << 3 = 1000
-    ack = flags & (1 << 2)  # 1 << 2 = 0100
-    fin = flags & (1 << 1)  # 1 << 1 = 0010
-    # rst = flags & 1       # 1 << 0 = 0001
+    syn = flags & SYN_FLAG  # 1000
+    ack = flags & ACK_FLAG  # 0100
+    fin = flags & FIN_FLAG  # 0010
 
     # Return flags as a named tuple Flags
     return Flags(bool(syn), bool(ack), bool(fin))
@@ -877,38 +2245,10 @@ def create_packet(seq: int, ack: int, flags: int, win: int, data: bytes = None)
     :param ack: acknowledgment number of the packet (4 bytes)
     :param flags: flags of the packet (2 bytes)
     :param win: receiver window of the packet (2 bytes)
-    :param data: application data of the packet (1460 bytes)
-    :return: packet with header and application data (1472 bytes)
+    :param data: application data of the packet (at most the payload size of the transfer)
+    :return: packet with header and application data
     """
-    header = pack(HEADER_FORMAT, seq, ack, flags, win)
-
-    packet = header  # 12 bytes
-
-    if data:
-        packet += data  # 1460 bytes
-
-    return packet  # 1472 bytes
-
-
-def set_flags(syn: bool = False, ack: bool = False, fin: bool = False) -> int:
-    """
-    Set flags for a packet header
-    :param syn: bool indicating if syn flag should be set
-    :param ack: bool indicating if ack flag should be set
-    :param fin: bool indicating if fin flag should be set
-    :return: int representing the flags in the header
-    """
-    flag = 0
-    if syn:
-        flag |= 1 << 3  # 1 << 3 = 1000
-    if ack:
-        flag |= 1 << 2  # 1 << 2 = 0100
-    if fin:
-        flag |= 1 << 1  # 1 << 1 = 0010
-    # if rst:
-    #     flag |= 1       # 1 << 0 = 0001
-
-    return flag
+    return encode(seq, ack, flags, win, data)
 
 
 """ MAIN """
@@ -918,10 +2258,10 @@ if __name__ == '__main__':
 
     if args.server:
         print_in_block("Running in server mode")
-        server = Server()
+        server = Server(args)
         server.start_server()
 
     if args.client:
         print_in_block("Running in client mode")
-        client = Client()
+        client = Client(args)
         client.start_client()
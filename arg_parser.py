@@ -2,6 +2,7 @@ import argparse
 import ipaddress
 import os
 import sys
+from typing import List, Optional
 
 
 def check_port(val: str) -> int:
@@ -19,6 +20,98 @@ def check_port(val: str) -> int:
     return val
 
 
+def check_buffer_size(val: str) -> int:
+    """
+    Checks if the buffer size is a valid number of packets between 1 and 65535
+    The upper limit is the largest window that fits in the window field of the header
+    :param val: buffer size specified by user
+    :return: buffer size as an integer
+    """
+    try:
+        val = int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected integer but got string")
+    if val < 1 or val > 65535:
+        raise argparse.ArgumentTypeError("expected an integer between 1 and 65535")
+    return val
+
+
+def check_delayed_ack(val: str) -> int:
+    """
+    Checks if the number of packets per ack is a valid number between 1 and 64
+    :param val: number of packets per ack specified by user
+    :return: number of packets per ack as an integer
+    """
+    try:
+        val = int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected integer but got string")
+    if val < 1 or val > 64:
+        raise argparse.ArgumentTypeError("expected an integer between 1 and 64")
+    return val
+
+
+def check_streams(val: str) -> int:
+    """
+    Checks if the number of parallel streams is a valid number between 1 and 64
+    :param val: number of streams specified by user
+    :return: number of streams as an integer
+    """
+    try:
+        val = int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected integer but got string")
+    if val < 1 or val > 64:
+        raise argparse.ArgumentTypeError("expected an integer between 1 and 64")
+    return val
+
+
+def check_payload_size(val: str) -> int:
+    """
+    Checks if the payload size is a valid number of bytes between 64 and 65495
+    The upper limit is the largest UDP datagram over IPv4 minus the header of a packet
+    :param val: payload size specified by user
+    :return: payload size as an integer
+    """
+    try:
+        val = int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected integer but got string")
+    if val < 64 or val > 65495:
+        raise argparse.ArgumentTypeError("expected an integer between 64 and 65495")
+    return val
+
+
+def check_fec_block(val: str) -> int:
+    """
+    Checks if the number of data packets in a block of forward error correction is a valid number between 2 and 255
+    :param val: block size specified by user
+    :return: block size as an integer
+    """
+    try:
+        val = int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected integer but got string")
+    if val < 2 or val > 255:
+        raise argparse.ArgumentTypeError("expected an integer between 2 and 255")
+    return val
+
+
+def check_rate_limit(val: str) -> float:
+    """
+    Checks if the rate limit is a positive number of megabits per second
+    :param val: rate limit specified by user
+    :return: rate limit as a float
+    """
+    try:
+        val = float(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected number but got string")
+    if not 0 < val < float("inf"):
+        raise argparse.ArgumentTypeError("expected a positive number")
+    return val
+
+
 def check_ip(val: str):
     """
     Checks if the IP address is valid
@@ -34,19 +127,20 @@ def check_ip(val: str):
 
 def check_file(val: str):
     """
-    Checks if the file exists on the system
+    Checks if the file or directory exists on the system
     :param val: filename specified by user
     :return: filename as a string
     """
-    if not os.path.isfile(val):
-        raise argparse.ArgumentTypeError(f"expected a valid file, got {val}")
+    if not os.path.isfile(val) and not os.path.isdir(val):
+        raise argparse.ArgumentTypeError(f"expected a valid file or directory, got {val}")
     return val
 
 
-def parse_args():
+def parse_args(argv: Optional[List[str]] = None):
     """
     Parses the arguments given by the user, transforms and returns them.
     Throws an error if the arguments are invalid.
+    :param argv: arguments to parse, defaults to the command line arguments
     :return: parsed arguments given by the user transformed into the correct type
     """
     parser = argparse.ArgumentParser(description="positional arguments", epilog="end of help",
@@ -58,13 +152,37 @@ def parse_args():
     parser.add_argument("-p", "--port", type=check_port, default=8088, help="The port to listen on")
     parser.add_argument("-r", "--reliable_method", choices=("saw", "gbn", "sr"), default="saw",
                         help="The reliability functions to use, Stop And Wait, Go Back N or Selective Repeat")
-    parser.add_argument("-f", "--file", type=check_file, help="The file to send")
+    parser.add_argument("-f", "--file", type=check_file, nargs="+",
+                        help="The file to send, a directory or several files are sent together over one connection")
     parser.add_argument("-t", "--test_case", choices=("skip_ack", "skip_seq"), help="The test case to run")
     parser.add_argument("-w", "--window_size", type=int, default=5, help="The window size to use")
+    parser.add_argument("-a", "--congestion_control", choices=("none", "reno", "cubic"), default="none",
+                        help="The congestion control algorithm to use, the window size is the largest window it can use")
+    parser.add_argument("-b", "--buffer_size", type=check_buffer_size, default=1024,
+                        help="The number of packets of 1460 bytes the server can buffer, advertised as the receiver window")
+    parser.add_argument("-d", "--delayed_ack", type=check_delayed_ack, default=1,
+                        help="Ack every N packets received in order, or after 10 ms (go back N and selective repeat)")
+    parser.add_argument("-z", "--compress", action="store_true",
+                        help="Compress the data, packets of data that does not compress are sent as they are")
+    parser.add_argument("-n", "--streams", type=check_streams, default=1,
+                        help="Split the file into ranges and send them over N parallel streams")
+    parser.add_argument("-m", "--payload_size", type=check_payload_size, default=65495,
+                        help="The largest payload of a packet, the path MTU is probed for the largest that gets through")
+    parser.add_argument("-e", "--fec", type=check_fec_block,
+                        help="Send parity packets for every block of N data packets, so the server can rebuild lost "
+                             "packets without a retransmission (selective repeat)")
+    parser.add_argument("-g", "--pacing", action="store_true",
+                        help="Spread the packets of the window over the round trip instead of sending them back to back "
+                             "(go back N and selective repeat)")
+    parser.add_argument("-l", "--rate_limit", type=check_rate_limit,
+                        help="Pace the packets to at most this many megabits per second, shared by the streams "
+                             "(go back N and selective repeat)")
+    parser.add_argument("-k", "--keep_running", action="store_true",
+                        help="Keep running after a transfer and receive files from many clients at the same time")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose mode")
 
     # Runs the parser and places the extracted data
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Check if the user has specified server or client mode
     # Equality means that the user har either specified both or neither, which is invalid
@@ -79,6 +197,24 @@ def parse_args():
         if args.test_case == "skip_ack":
             parser.error("You cannot run skip_ack in client mode")
 
+        if args.buffer_size != 1024:
+            parser.error("You cannot specify a buffer size in client mode")
+
+        if args.delayed_ack != 1:
+            parser.error("You cannot specify delayed acks in client mode")
+
+        if args.keep_running:
+            parser.error("You cannot keep running in client mode")
+
+        if args.streams != 1 and (len(args.file) > 1 or os.path.isdir(args.file[0])):
+            parser.error("You cannot send a directory or several files over parallel streams")
+
+        if args.fec and args.reliable_method != "sr":
+            parser.error("You can only use forward error correction with selective repeat")
+
+        if (args.pacing or args.rate_limit) and args.reliable_method == "saw":
+            parser.error("You can only pace the packets of go back N and selective repeat")
+
     # Check if the arguments are valid for server mode
     if args.server:
         if args.test_case == "skip_seq":
@@ -90,4 +226,22 @@ def parse_args():
         if args.window_size != 5:
             parser.error("You cannot specify a window size in server mode")
 
+        if args.congestion_control != "none":
+            parser.error("You cannot specify a congestion control algorithm in server mode")
+
+        if args.streams != 1:
+            parser.error("You cannot specify a number of streams in server mode")
+
+        if args.compress:
+            parser.error("You cannot specify compression in server mode, the client decides")
+
+        if args.fec:
+            parser.error("You cannot specify forward error correction in server mode, the client decides")
+
+        if args.pacing or args.rate_limit:
+            parser.error("You cannot pace packets in server mode")
+
+        if args.payload_size != 65495:
+            parser.error("You cannot specify a payload size in server mode, the client decides")
+
     return args
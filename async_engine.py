@@ -0,0 +1,217 @@
+import asyncio
+import os
+import time
+from argparse import Namespace
+from typing import List, Optional, Tuple
+
+import application
+from application import Client, Server, Packet, Stream, split_ranges
+
+"""
+asyncio engine for DRTP.
+The transfers of the client and the connections of the server do not do any I/O themselves, so the same saw, gbn and
+sr logic that runs on blocking sockets in application.py runs here on datagram endpoints of an event loop. One process
+can then run many transfers at the same time, and other asyncio services can embed them.
+The options are the same as the command line options (see arg_parser.parse_args), and every client and server keeps
+its own, so transfers with different options run side by side.
+"""
+
+
+class AsyncClient(Client, asyncio.DatagramProtocol):
+    """
+    Client that runs its transfer on a datagram endpoint.
+    Acks are collected as they arrive, and the waits of the transfer are timers of the event loop.
+    """
+
+    def __init__(self, options: Namespace, filepath: Optional[str] = None, stream: Optional[Stream] = None):
+        """
+        Initialize client using arguments
+        :param options: client options
+        :param filepath: file to send, defaults to options.file
+        :param stream: range of the file to send when it is one of several parallel streams, defaults to the whole file
+        """
+        Client.__init__(self, options, filepath, stream)
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.received: List[bytes] = []
+        self.arrived = asyncio.Event()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+        # The handshake probes the path MTU with options of the socket
+        self.client_socket = transport.get_extra_info("socket")
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.received.append(data)
+        self.arrived.set()
+
+    def error_received(self, exc: Exception) -> None:
+        # The server is not reachable (yet), handled like a lost ack
+        pass
+
+    def transmit(self, packets: List[Packet]) -> None:
+        """
+        Send packets on the transport
+        :param packets: packets to send, in order
+        """
+        for packet in packets:
+            # The transport can not gather buffers, so a header and the data it carries are joined
+            self.transport.sendto(b"".join(packet) if isinstance(packet, tuple) else packet)
+
+    async def receive_acks_async(self, wait: float) -> List[Tuple[int, bytes]]:
+        """
+        Wait for an ack from server and then take all acks that have arrived
+        :param wait: longest time to wait in seconds
+        :return: list of (ack number, SACK bitmap), empty if no ack was received
+        """
+        if not self.received:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+        packages, self.received = self.received, []
+        return self.parse_acks(packages)
+
+    async def run_async(self) -> None:
+        """
+        Run the transfer. Every time the transfer asks to wait, the event loop waits that long for acks, and the
+        acks are handed back to the transfer.
+        """
+        transfer = self.transfer()
+        try:
+            wait = next(transfer)
+            while True:
+                wait = transfer.send(await self.receive_acks_async(wait))
+        except StopIteration:
+            pass
+
+
+class AsyncServer(Server, asyncio.DatagramProtocol):
+    """
+    Server that runs its connections on a datagram endpoint.
+    Packages are handed to the connections as they arrive, and one timer of the event loop runs the connection
+    timers when the earliest of them is due.
+    """
+
+    def __init__(self, options: Namespace):
+        """
+        Initialize server using arguments
+        :param options: server options
+        """
+        Server.__init__(self, options)
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.loop = asyncio.get_running_loop()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_deadline: Optional[float] = None
+        self.done = self.loop.create_future()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+        application.grow_receive_buffer(transport.get_extra_info("socket"),
+                                        self.options.buffer_size * application.PACKAGE_SIZE)
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.dispatch(memoryview(data), address)
+        self.update()
+
+    def on_timer(self) -> None:
+        """
+        Run the connection timers that are due
+        """
+        self.timer = None
+        self.timer_deadline = None
+        self.run_timers()
+        self.update()
+
+    def update(self) -> None:
+        """
+        Send the queued packages, and set the timer of the event loop to the earliest connection timer.
+        The timer is only moved when an earlier connection timer has been added, outdated timers just run early.
+        """
+        self.flush()
+
+        if self.is_done():
+            if not self.done.done():
+                self.done.set_result(None)
+            return
+
+        if self.timers and (self.timer_deadline is None or self.timers[0][0] < self.timer_deadline):
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer_deadline = self.timers[0][0]
+            self.timer = self.loop.call_later(max(self.timer_deadline - time.monotonic(), 0), self.on_timer)
+
+    def flush(self) -> None:
+        """
+        Send all queued packages on the transport
+        """
+        for package, address in zip(self.queued_packages, self.queued_addresses):
+            self.transport.sendto(package, address)
+        self.queued_packages.clear()
+        self.queued_addresses.clear()
+
+
+async def send_file(options: Namespace, filepath: Optional[str] = None) -> None:
+    """
+    Send a file to the server. With options.streams, the file is split into ranges like Client.send_parallel does, and
+    every range is sent as its own stream, by its own client on its own endpoint of the event loop.
+    :param options: client options
+    :param filepath: file to send, defaults to options.file
+    :raises Exception: if the file could not be sent, the error of the first stream that failed
+    """
+    if options.streams <= 1:
+        await send_stream(options, filepath)
+        return
+
+    paths = [filepath] if filepath is not None else options.file
+    if len(paths) > 1 or os.path.isdir(paths[0]):
+        raise Exception("A directory or several files can not be sent over parallel streams")
+    ranges = split_ranges(os.path.getsize(paths[0]), options.streams)
+    transfer_id = os.urandom(8).hex()
+    streams = [Stream(transfer_id, index, len(ranges), offset, length) for index, (offset, length) in enumerate(ranges)]
+    tasks = [asyncio.ensure_future(send_stream(options, paths[0], stream)) for stream in streams]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # The other streams can not complete the file when one has failed
+        for task in tasks:
+            task.cancel()
+
+
+async def send_stream(options: Namespace, filepath: Optional[str] = None, stream: Optional[Stream] = None) -> None:
+    """
+    Send a file, or one range of it, to the server over one stream
+    :param options: client options
+    :param filepath: file to send, defaults to options.file
+    :param stream: range of the file to send when it is one of several parallel streams, defaults to the whole file
+    :raises Exception: if the file could not be sent
+    """
+    loop = asyncio.get_running_loop()
+    client = AsyncClient(options, filepath, stream)
+    transport, _ = await loop.create_datagram_endpoint(lambda: client, remote_addr=(options.ip, options.port))
+    try:
+        await client.run_async()
+    finally:
+        transport.close()
+
+
+async def serve(options: Namespace) -> None:
+    """
+    Receive files from clients, until the first transfer has ended or, with keep_running, until the task is cancelled
+    :param options: server options
+    :raises Exception: if the transfer failed, when not keeping running
+    """
+    loop = asyncio.get_running_loop()
+    server = AsyncServer(options)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=(options.ip, options.port))
+    try:
+        await server.done
+    finally:
+        if server.timer is not None:
+            server.timer.cancel()
+        server.close_connections()
+        transport.close()
+
+    if server.error:
+        raise Exception(server.error)
@@ -0,0 +1,266 @@
+import ctypes
+import ctypes.util
+import socket
+import sys
+from typing import List, Optional, Sequence, Tuple, Union
+
+# sendmmsg and recvmmsg are not exposed by the socket module, so they are called from libc with ctypes on Linux.
+# On other platforms, or if libc does not have them, the batch functions fall back to one call per datagram.
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+# A datagram is either one buffer, or a tuple of buffers that are gathered into one datagram when it is sent
+Datagram = Union[bytes, bytearray, memoryview, Tuple[Union[bytes, bytearray, memoryview], ...]]
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [("buf", ctypes.c_void_p), ("obj", ctypes.py_object), ("len", ctypes.c_ssize_t),
+                ("itemsize", ctypes.c_ssize_t), ("readonly", ctypes.c_int), ("ndim", ctypes.c_int),
+                ("format", ctypes.c_char_p), ("shape", ctypes.c_void_p), ("strides", ctypes.c_void_p),
+                ("suboffsets", ctypes.c_void_p), ("internal", ctypes.c_void_p)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16), ("sin_addr", ctypes.c_uint8 * 4),
+                ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+def _load_libc():
+    """
+    Load sendmmsg and recvmmsg from libc
+    :return: libc with the two functions, or None if they are not available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def _load_buffer_api():
+    """
+    Load the functions of the python buffer protocol, which give the address of a read-only buffer such as a view of
+    a read-only memory map. ctypes.c_char.from_buffer only accepts writable buffers.
+    :return: the python API with the two functions, or None if they are not available
+    """
+    try:
+        api = ctypes.pythonapi
+        api.PyObject_GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(_PyBuffer), ctypes.c_int]
+        api.PyObject_GetBuffer.restype = ctypes.c_int
+        api.PyBuffer_Release.argtypes = [ctypes.POINTER(_PyBuffer)]
+        api.PyBuffer_Release.restype = None
+        return api
+    except AttributeError:
+        return None
+
+
+_buffer_api = _load_buffer_api()
+_PYBUF_SIMPLE = 0
+
+
+class BatchIO:
+    """
+    Sends and receives datagrams in batches on a UDP socket.
+    On Linux a whole batch is sent with one sendmmsg call and all queued datagrams are drained with one recvmmsg call.
+    Elsewhere every datagram is sent with its own call, and queued datagrams are drained one by one if the platform
+    supports non-blocking receives, otherwise only one datagram is received per call.
+    The message headers and receive buffers are allocated once and reused for every call, datagrams are received
+    straight into the buffers and can be handed out as memoryviews without copying them.
+    A datagram can be sent from several buffers, such as a header and a view of the data, which are gathered by the
+    kernel (scatter-gather) so they never have to be joined in python.
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int, max_batch: int = 64, max_parts: int = 2):
+        """
+        Create batch I/O for a socket
+        :param sock: UDP socket, connected or not
+        :param buffer_size: size of the largest datagram that can be received
+        :param max_batch: largest number of datagrams sent or received in one call
+        :param max_parts: largest number of buffers a datagram that is sent can be gathered from
+        """
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.max_batch = max_batch
+        self.max_parts = max_parts
+        self.batched = _libc is not None
+
+        if self.batched:
+            self._send_iov = [(_IoVec * max_parts)() for _ in range(max_batch)]
+            self._send_msgs = (_MMsgHdr * max_batch)()
+            self._send_names = (_SockAddrIn * max_batch)()
+            for i in range(max_batch):
+                self._send_msgs[i].msg_hdr.msg_iov = ctypes.cast(self._send_iov[i], ctypes.POINTER(_IoVec))
+
+        # Slot 0 is used for the first datagram of a batch, the rest for the datagrams drained after it
+        self._recv_buffers = [bytearray(buffer_size) for _ in range(max_batch)]
+        self._recv_views = [memoryview(buffer) for buffer in self._recv_buffers]
+
+        if self.batched:
+            self._recv_iov = (_IoVec * max_batch)()
+            self._recv_msgs = (_MMsgHdr * max_batch)()
+            self._recv_names = (_SockAddrIn * max_batch)()
+            for i in range(max_batch):
+                self._recv_iov[i].iov_base = ctypes.addressof(ctypes.c_char.from_buffer(self._recv_buffers[i]))
+                self._recv_iov[i].iov_len = buffer_size
+                self._recv_msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._recv_iov[i])
+                self._recv_msgs[i].msg_hdr.msg_iovlen = 1
+                self._recv_msgs[i].msg_hdr.msg_name = ctypes.addressof(self._recv_names[i])
+                self._recv_msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+
+    def send(self, packets: Sequence[Datagram], address: Optional[Tuple[str, int]] = None,
+             addresses: Optional[Sequence[Tuple[str, int]]] = None) -> None:
+        """
+        Send all packets, in order
+        :param packets: packets to send, a packet given as a tuple of buffers is sent as one datagram
+        :param address: destination address of every packet, None if the socket is connected
+        :param addresses: destination address of each packet, overrides address so one batch can go to many peers
+        """
+        sent = 0
+        if self.batched:
+            while sent < len(packets):
+                count = min(len(packets) - sent, self.max_batch)
+                # Keep references to the packets until the call returns, ctypes only borrows their buffers
+                pinned = []
+                for i in range(count):
+                    parts = packets[sent + i]
+                    if not isinstance(parts, tuple):
+                        parts = (parts,)
+                    if len(parts) > self.max_parts:
+                        raise ValueError(f"Datagram has {len(parts)} parts, at most {self.max_parts} are supported")
+                    for j, part in enumerate(parts):
+                        address_of_part, part = self._buffer_address(part)
+                        pinned.append(part)
+                        self._send_iov[i][j].iov_base = address_of_part
+                        self._send_iov[i][j].iov_len = len(part)
+                    self._send_msgs[i].msg_hdr.msg_iovlen = len(parts)
+                    destination = addresses[sent + i] if addresses is not None else address
+                    if destination is not None:
+                        self._set_address(self._send_names[i], destination)
+                        self._send_msgs[i].msg_hdr.msg_name = ctypes.addressof(self._send_names[i])
+                        self._send_msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+                    else:
+                        self._send_msgs[i].msg_hdr.msg_name = None
+                        self._send_msgs[i].msg_hdr.msg_namelen = 0
+
+                result = _libc.sendmmsg(self.sock.fileno(), self._send_msgs, count, 0)
+                del pinned
+                if result <= 0:
+                    # Socket buffer full or an error, the socket module waits or raises for the rest
+                    break
+                sent += result
+
+        for i in range(sent, len(packets)):
+            packet = packets[i]
+            destination = addresses[i] if addresses is not None else address
+            if isinstance(packet, tuple):
+                if hasattr(self.sock, "sendmsg"):
+                    if destination is None:
+                        self.sock.sendmsg(packet)
+                    else:
+                        self.sock.sendmsg(packet, [], 0, destination)
+                    continue
+                # No scatter-gather on this platform
+                packet = b"".join(packet)
+            if destination is None:
+                self.sock.send(packet)
+            else:
+                self.sock.sendto(packet, destination)
+
+    def receive(self) -> List[Tuple[bytes, Tuple[str, int]]]:
+        """
+        Wait for a datagram, using the timeout of the socket, and then drain the datagrams that are already queued
+        :return: list of (datagram, source address), with at least one datagram
+        :raises socket.timeout: if no datagram arrives before the timeout of the socket
+        """
+        return [(bytes(view), address) for view, address in self.receive_into()]
+
+    def receive_into(self) -> List[Tuple[memoryview, Tuple[str, int]]]:
+        """
+        Same as receive, but the datagrams are returned as views of the receive buffers instead of being copied.
+        The views are only valid until the next call, when the buffers are reused.
+        :return: list of (view of datagram, source address), with at least one datagram
+        :raises socket.timeout: if no datagram arrives before the timeout of the socket
+        """
+        size, address = self.sock.recvfrom_into(self._recv_buffers[0])
+        datagrams = [(self._recv_views[0][:size], address)]
+
+        if self.batched and self.max_batch > 1:
+            count = _libc.recvmmsg(self.sock.fileno(), ctypes.byref(self._recv_msgs[1]), self.max_batch - 1,
+                                   _MSG_DONTWAIT, None)
+            for i in range(1, max(count, 0) + 1):
+                msg = self._recv_msgs[i]
+                datagrams.append((self._recv_views[i][:msg.msg_len], self._get_address(self._recv_names[i])))
+                msg.msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        elif _MSG_DONTWAIT:
+            while len(datagrams) < self.max_batch:
+                try:
+                    size, address = self.sock.recvfrom_into(self._recv_buffers[len(datagrams)], 0, _MSG_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                datagrams.append((self._recv_views[len(datagrams)][:size], address))
+
+        return datagrams
+
+    @staticmethod
+    def _buffer_address(packet) -> Tuple[int, object]:
+        """
+        Get the address of the memory holding a packet, without copying it if possible
+        :param packet: bytes or a buffer such as a bytearray or a view of a memory map
+        :return: address and the object that owns the memory, which must be kept alive while the address is used
+        """
+        if not isinstance(packet, bytes):
+            try:
+                return ctypes.addressof(ctypes.c_char.from_buffer(packet)), packet
+            except (TypeError, ValueError):
+                pass
+            if _buffer_api is not None and len(packet) > 0:
+                # Read-only buffer, the packet keeps the memory exported after the buffer is released
+                view = _PyBuffer()
+                if _buffer_api.PyObject_GetBuffer(packet, ctypes.byref(view), _PYBUF_SIMPLE) == 0:
+                    address = view.buf
+                    _buffer_api.PyBuffer_Release(ctypes.byref(view))
+                    return address, packet
+            # Empty buffer, or no buffer protocol to read the address with
+            packet = bytes(packet)
+        return ctypes.cast(ctypes.c_char_p(packet), ctypes.c_void_p).value, packet
+
+    @staticmethod
+    def _set_address(name: _SockAddrIn, address: Tuple[str, int]) -> None:
+        """
+        Fill in an IPv4 socket address
+        :param name: structure to fill in
+        :param address: (ip, port) tuple
+        """
+        name.sin_family = socket.AF_INET
+        name.sin_port = socket.htons(address[1])
+        name.sin_addr[:] = socket.inet_aton(address[0])
+
+    @staticmethod
+    def _get_address(name: _SockAddrIn) -> Tuple[str, int]:
+        """
+        Read an IPv4 socket address
+        :param name: structure filled in by the kernel
+        :return: (ip, port) tuple
+        """
+        return socket.inet_ntoa(bytes(name.sin_addr)), socket.ntohs(name.sin_port)
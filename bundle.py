@@ -0,0 +1,297 @@
+import os
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from typing import List, NamedTuple, Optional, Tuple
+
+from file_sink import FileSink
+from file_source import FileSource
+
+"""
+Bundles of many files sent as one stream of data.
+A bundle is a manifest listing every file and its size, followed by the data of the files back to back. Small files
+share packets with the files around them and large files are streamed one after the other, so a whole directory
+tree costs one handshake instead of one for every file.
+"""
+
+# An entry of the manifest, a path relative to the root of the bundle. Directories end with "/" and have no data.
+Entry = NamedTuple('Entry', path=str, size=int)
+
+# Largest number of files kept mapped by the sender, packets of older files may still be resent by the window
+OPEN_SOURCES = 64
+
+
+def collect_entries(paths: List[str]) -> Tuple[List[Entry], List[str]]:
+    """
+    List the files and directories to send. A directory is sent with everything in it, under its own name, unless it
+    is the only path: then everything in it is sent, and it is the root of the bundle itself.
+    :param paths: files and directories to send
+    :return: entries of the manifest in the order their data is sent, and the path on disk of every file with data
+    :raises Exception: if two paths end up with the same name in the bundle
+    """
+    entries = []
+    files = []
+
+    def add_file(name: str, path: str) -> None:
+        size = os.path.getsize(path)
+        entries.append(Entry(name, size))
+        if size > 0:
+            files.append(path)
+
+    for path in paths:
+        name = os.path.basename(os.path.normpath(path))
+        if not os.path.isdir(path):
+            add_file(name, path)
+            continue
+
+        if len(paths) == 1:
+            name = ""
+        else:
+            entries.append(Entry(name + "/", 0))
+        for directory, children, file_names in os.walk(path):
+            children.sort()
+            relative = os.path.relpath(directory, path).replace(os.sep, "/")
+            prefix = "/".join(part for part in (name, relative) if part and part != ".")
+            prefix = prefix + "/" if prefix else ""
+            entries.extend(Entry(f"{prefix}{child}/", 0) for child in children)
+            for file_name in sorted(file_names):
+                add_file(f"{prefix}{file_name}", os.path.join(directory, file_name))
+
+    names = [entry.path for entry in entries]
+    if len(set(names)) != len(names):
+        raise Exception("Two of the files to send have the same name")
+    return entries, files
+
+
+def encode_manifest(entries: List[Entry]) -> bytes:
+    """
+    Encode the manifest, one "size path" line for every entry
+    :param entries: entries of the manifest
+    :return: encoded manifest
+    :raises Exception: if a path contains a line break
+    """
+    if any("\n" in entry.path for entry in entries):
+        raise Exception("File names with line breaks can not be sent")
+    return "".join(f"{entry.size} {entry.path}\n" for entry in entries).encode()
+
+
+def decode_manifest(manifest: bytes) -> List[Entry]:
+    """
+    Decode the manifest
+    :param manifest: encoded manifest
+    :return: entries of the manifest
+    """
+    entries = []
+    for line in manifest.decode().splitlines():
+        size, _, path = line.partition(" ")
+        entries.append(Entry(path, int(size)))
+    return entries
+
+
+def safe_join(root: str, path: str) -> str:
+    """
+    Get where an entry of the manifest is written, an entry can never be written outside the root directory
+    :param root: directory the bundle is received into
+    :param path: path of the entry, relative to the root
+    :return: path to write
+    :raises ValueError: if the path is absolute or leaves the root directory
+    """
+    parts = path.rstrip("/").split("/")
+    for part in parts:
+        # Empty parts come from absolute paths and repeated slashes, the other separators from other platforms
+        if part in ("", ".", "..") or "\\" in part or ":" in part:
+            raise ValueError(f"Invalid path in manifest: {path}")
+    return os.path.join(root, *parts)
+
+
+class BundleSource:
+    """
+    Reads a bundle as if it was one file: the manifest, then the data of every file.
+    Files are memory mapped when their data is first read, and only the most recently read files are kept mapped.
+    """
+
+    def __init__(self, paths: List[str]):
+        """
+        List the files and build the manifest
+        :param paths: files and directories to send
+        """
+        self.entries, self._paths = collect_entries(paths)
+        self.manifest = encode_manifest(self.entries)
+
+        # Where the data of every file with data starts in the bundle
+        self._starts = []
+        offset = len(self.manifest)
+        for entry in self.entries:
+            if entry.size > 0:
+                self._starts.append(offset)
+                offset += entry.size
+        self.size = offset
+        self._sources = OrderedDict()
+
+    def read_at(self, offset: int, length: int) -> memoryview:
+        """
+        Get a chunk of the bundle. A chunk inside one file is a view of its map, a chunk that spans several files or
+        the end of the manifest is copied together.
+        :param offset: offset in bytes from the start of the bundle
+        :param length: largest number of bytes to get
+        :return: the chunk, shorter than length at the end of the bundle and empty after it
+        """
+        end = min(offset + length, self.size)
+        chunks = []
+        while offset < end:
+            if offset < len(self.manifest):
+                chunk = memoryview(self.manifest)[offset:end]
+            else:
+                index = bisect_right(self._starts, offset) - 1
+                start = self._starts[index]
+                chunk = self._source(index).read_at(offset - start, end - offset)
+                if not chunk:
+                    raise Exception(f"{self._paths[index]} changed while it was being sent")
+            chunks.append(chunk)
+            offset += len(chunk)
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return memoryview(b"".join(chunks))
+
+    def _source(self, index: int) -> FileSource:
+        """
+        Get the map of a file, mapping it if it is not mapped already
+        :param index: index of the file
+        :return: mapped file
+        """
+        source = self._sources.get(index)
+        if source is None:
+            source = FileSource(self._paths[index])
+            self._sources[index] = source
+            if len(self._sources) > OPEN_SOURCES:
+                self._sources.popitem(last=False)[1].close()
+        else:
+            self._sources.move_to_end(index)
+        return source
+
+    def close(self) -> None:
+        """
+        Unmap every file. Calling close more than once has no effect.
+        """
+        while self._sources:
+            self._sources.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BundleSink:
+    """
+    Writes a bundle back into a directory tree as it arrives.
+    The data of a bundle must be written in order, which the receivers of every method do: the manifest is collected
+    first, and then every file is created, preallocated and written to disk in turn.
+    """
+
+    def __init__(self, path: str, size: int, manifest_length: int):
+        """
+        Create the directory the bundle is received into
+        :param path: directory to write the files in
+        :param size: size of the bundle in bytes
+        :param manifest_length: size of the manifest at the start of the bundle
+        """
+        self.path = path
+        self.size = size
+        self.bytes_written = 0
+        self.manifest_length = manifest_length
+        self.entries: Optional[List[Entry]] = None
+
+        self._manifest = bytearray()
+        self._pending = deque()
+        self._file: Optional[FileSink] = None
+        self._file_start = 0
+        self._file_end = manifest_length
+
+        os.makedirs(path, exist_ok=True)
+        if manifest_length == 0:
+            self._read_manifest()
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        """
+        Write the data that follows what has been written so far. Data that has already been written is skipped.
+        :param offset: offset in bytes from the start of the bundle
+        :param data: data to write
+        :raises ValueError: if the data leaves a gap, does not fit in the bundle or the sink is closed
+        """
+        if self._pending is None:
+            raise ValueError("File is closed")
+        if offset > self.bytes_written:
+            raise ValueError(f"Chunk at offset {offset} is written before the data in front of it")
+        if offset + len(data) > self.size:
+            raise ValueError(f"Chunk at offset {offset} with length {len(data)} is outside the file")
+
+        view = memoryview(data)[self.bytes_written - offset:]
+        while view:
+            take = min(len(view), self._file_end - self.bytes_written)
+            if self.entries is None:
+                self._manifest += view[:take]
+            else:
+                self._file.write_at(self.bytes_written - self._file_start, view[:take])
+            self.bytes_written += take
+            view = view[take:]
+
+            if self.bytes_written == self._file_end:
+                if self.entries is None:
+                    self._read_manifest()
+                else:
+                    self._next_file()
+
+    def _read_manifest(self) -> None:
+        """
+        Decode the manifest when all of it has arrived, and create the directories and the first file
+        """
+        self.entries = decode_manifest(bytes(self._manifest))
+        self._manifest = None
+        if sum(entry.size for entry in self.entries) != self.size - self.manifest_length:
+            raise ValueError("The manifest does not match the size of the bundle")
+        self._pending.extend(self.entries)
+        self._next_file()
+
+    def _next_file(self) -> None:
+        """
+        Close the file that has been written, and open the next file that has data.
+        Directories and empty files are created on the way.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        while self._pending:
+            entry = self._pending.popleft()
+            target = safe_join(self.path, entry.path)
+            if entry.path.endswith("/"):
+                os.makedirs(target, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            file = FileSink(target, entry.size)
+            if entry.size == 0:
+                file.close()
+                continue
+
+            self._file = file
+            self._file_start = self.bytes_written
+            self._file_end = self.bytes_written + entry.size
+            return
+
+    def close(self) -> None:
+        """
+        Close the file being written. Calling close more than once has no effect.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
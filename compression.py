@@ -0,0 +1,203 @@
+import time
+import zlib
+from struct import Struct
+from typing import Dict, Tuple, Union
+
+"""
+Compression of the data of a transfer.
+The data is compressed packet by packet: every packet carries as much data as fits in it after compression, and the
+offset of that data, so every packet can be decoded and written on its own and in any order. Packets of data that
+does not compress are sent raw, and compression is only tried again after PROBE_INTERVAL raw packets.
+"""
+
+# Flags and offset of the data in the range of the stream, in front of the data of every packet
+BLOCK_HEADER = Struct("!BQ")
+COMPRESSED_FLAG = 1
+
+LEVEL = 6  # zlib compression level
+PROBE_INTERVAL = 16  # Packets sent raw after a packet that did not compress, before compression is tried again
+MAX_RATIO = 64.0  # Largest amount of data tried in one packet, as a multiple of the payload
+HASH_CHUNK = 1 << 20  # Bytes hashed at a time when the start of the range is skipped
+
+
+class CompressedSource:
+    """
+    Compresses a range of the data to send into packets just ahead of the sender, as its window asks for them.
+    Packets are kept in memory until the sender releases them, when they can no longer be resent, so memory use
+    depends on the window and not on the size of the range, and a packet that is resent is not compressed again.
+    The end of the range, and so the number of packets, is only known once all of it has been compressed.
+    Packets are read like a file, where the offset of a packet is its index.
+    """
+
+    def __init__(self, source, offset: int, length: int, packet_size: int, level: int = LEVEL, hasher=None,
+                 start: int = 0, first: int = 0):
+        """
+        Prepare to compress the range. The source is closed when the compressed source is closed.
+        :param source: mapped file or bundle of files to read the data from
+        :param offset: offset of the range in the source
+        :param length: length of the range in bytes
+        :param packet_size: largest size of a packet, including the block header
+        :param level: zlib compression level
+        :param hasher: hashlib object updated with the data of the range as it is read
+        :param start: number of bytes at the start of the range that are not sent, because the server already has
+        them from an earlier transfer, they are only hashed
+        :param first: index of the first packet, the packets before it were sent by an earlier transfer
+        """
+        self._source = source
+        self._offset = offset
+        self._length = length
+        self._payload = packet_size - BLOCK_HEADER.size
+        self._level = level
+        self._hasher = hasher
+
+        self.raw_size = 0  # Amount of data compressed
+        self.size = 0  # Amount of data in the packets made
+        self.compress_time = 0.0
+
+        self._packets: Dict[int, bytes] = {}  # Packets that have not been released, by index
+        self.count = first  # Number of packets made, including the packets before the first one
+        self._position = start  # Offset in the range of the data of the next packet
+        self._ratio = 1.0  # Expected amount of data for every byte of payload, from the last packet
+        self._raw_until = 0  # Packets up to this one are sent raw without trying to compress them
+
+        if hasher is not None:
+            position = 0
+            while position < start:
+                chunk = source.read_at(offset + position, min(start - position, HASH_CHUNK))
+                hasher.update(chunk)
+                position += len(chunk)
+
+    @property
+    def done(self) -> bool:
+        """
+        :return: True if the whole range has been compressed into packets
+        """
+        return self._position >= self._length
+
+    def extend(self, count: int) -> None:
+        """
+        Compress data into packets until there are count packets or the range has been compressed
+        :param count: number of packets wanted, including the packets before the first one
+        """
+        if self.count >= count or self.done:
+            return
+        start_time = time.time()
+        while self.count < count and not self.done:
+            self._compress_packet()
+        self.compress_time += time.time() - start_time
+
+    def _compress_packet(self) -> None:
+        """
+        Make the next packet, compressed or raw
+        """
+        remaining = self._length - self._position
+        body = None
+        if self.count >= self._raw_until:
+            size = min(int(self._payload * self._ratio), remaining)
+            chunk, body = self._compress(self._source, self._offset + self._position, size, self._payload,
+                                         self._level)
+        flags = COMPRESSED_FLAG
+        if body is None:
+            # The data does not compress, send it raw for a while
+            chunk = body = self._source.read_at(self._offset + self._position, min(self._payload, remaining))
+            flags = 0
+            self._ratio = 1.0
+            if self.count >= self._raw_until:
+                self._raw_until = self.count + 1 + PROBE_INTERVAL
+        else:
+            self._ratio = min(len(chunk) / len(body) * 0.95, MAX_RATIO)
+
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+        packet = BLOCK_HEADER.pack(flags, self._position) + body
+        self._packets[self.count] = packet
+        self.count += 1
+        self._position += len(chunk)
+        self.raw_size += len(chunk)
+        self.size += len(packet)
+
+    @staticmethod
+    def _compress(source, offset: int, size: int, payload: int, level: int) -> Tuple[memoryview, bytes]:
+        """
+        Compress as much data as fits in the payload of one packet, starting at an offset
+        :param source: mapped file or bundle of files to read the data from
+        :param offset: offset of the data in the source
+        :param size: amount of data to try first
+        :param payload: largest size of the compressed data
+        :param level: zlib compression level
+        :return: the data and the compressed data, None as compressed data if it does not get smaller
+        """
+        while True:
+            chunk = source.read_at(offset, size)
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            body = compressor.compress(chunk) + compressor.flush()
+            if len(body) <= payload:
+                return chunk, body if len(body) < len(chunk) else None
+
+            # Too much data for one packet, try again with as much as the compressed size suggests fits
+            size = int(size * payload / len(body) * 0.9)
+            if size <= payload:
+                return chunk, None
+
+    def segment(self, index: int) -> Tuple[int, int]:
+        """
+        Get where a packet is, compressing data up to it if it has not been made yet
+        :param index: index of the packet, starting at 0
+        :return: index and length of the packet, the length is 0 after the last packet
+        """
+        self.extend(index + 1)
+        if index >= self.count:
+            return index, 0
+        return index, len(self._packets[index])
+
+    def read_at(self, index: int, length: int) -> memoryview:
+        """
+        Get a packet without copying it
+        :param index: index of the packet, as given by segment
+        :param length: largest number of bytes to get
+        :return: view of the packet, empty after the last packet
+        """
+        packet = self._packets.get(index)
+        if packet is None:
+            return memoryview(b"")
+        return memoryview(packet)[:length]
+
+    def release(self, before: int) -> None:
+        """
+        Forget the packets that will not be sent again
+        :param before: index of the first packet that may still be sent
+        """
+        for index in [index for index in self._packets if index < before]:
+            del self._packets[index]
+
+    def close(self) -> None:
+        """
+        Forget the packets and close the source. Calling close more than once has no effect.
+        """
+        self._packets.clear()
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def decode(payload: Union[bytes, memoryview]) -> Tuple[int, Union[bytes, memoryview]]:
+    """
+    Decode the data of a packet
+    :param payload: data of the packet, starting with the block header
+    :return: offset of the data in the range of the stream, and the data
+    :raises ValueError: if compressed data is incomplete
+    """
+    flags, offset = BLOCK_HEADER.unpack_from(payload)
+    body = payload[BLOCK_HEADER.size:]
+    if not flags & COMPRESSED_FLAG:
+        return offset, body
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    data = decompressor.decompress(body)
+    if not decompressor.eof:
+        raise ValueError(f"Compressed data at offset {offset} is incomplete")
+    return offset, data
@@ -0,0 +1,162 @@
+import time
+from typing import Callable, Dict, Optional, Type
+
+
+class CongestionControl:
+    """
+    Base class of the congestion controllers used by the windowed senders.
+    The controller keeps a congestion window (cwnd) in packets that is updated from acks and losses.
+    The sender never has more than min(cwnd, max_window) packets in flight, so the window size given
+    on the command line is the upper cap of the congestion window.
+    """
+
+    def __init__(self, max_window: int):
+        """
+        Create a controller
+        :param max_window: largest window the sender may use, in packets
+        """
+        self.max_window = max_window
+        self.cwnd = 1.0
+        self.ssthresh = float(max_window)
+
+    @property
+    def window(self) -> int:
+        """
+        Get the number of packets the sender may have in flight
+        :return: effective send window in packets, at least 1
+        """
+        return max(1, min(int(self.cwnd), self.max_window))
+
+    def on_ack(self, acked: int, rtt: Optional[float]) -> None:
+        """
+        Called when packets are acknowledged
+        :param acked: number of packets newly acknowledged
+        :param rtt: smoothed round trip time in seconds, None if it is not known yet
+        """
+        raise NotImplementedError
+
+    def on_loss(self) -> None:
+        """
+        Called once per window of data when a packet is detected as lost while other packets still get through
+        """
+        raise NotImplementedError
+
+    def on_timeout(self) -> None:
+        """
+        Called on a retransmission timeout, when nothing is getting through
+        """
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = 1.0
+
+
+class FixedWindow(CongestionControl):
+    """
+    No congestion control, the window is always the window size given on the command line.
+    """
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.cwnd = float(max_window)
+
+    def on_ack(self, acked: int, rtt: Optional[float]) -> None:
+        pass
+
+    def on_loss(self) -> None:
+        pass
+
+    def on_timeout(self) -> None:
+        pass
+
+
+class Reno(CongestionControl):
+    """
+    AIMD congestion control in the style of TCP Reno.
+    The window grows by one packet per ack during slow start and by one packet per round trip after that (additive
+    increase). A loss halves the window (multiplicative decrease) and a timeout restarts slow start.
+    """
+
+    def on_ack(self, acked: int, rtt: Optional[float]) -> None:
+        if self.cwnd < self.ssthresh:
+            # Slow start
+            self.cwnd += acked
+        else:
+            # Congestion avoidance
+            self.cwnd += acked / self.cwnd
+        self.cwnd = min(self.cwnd, float(self.max_window))
+
+    def on_loss(self) -> None:
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = self.ssthresh
+
+
+class Cubic(CongestionControl):
+    """
+    CUBIC congestion control as described in RFC 8312.
+    After a loss the window grows along a cubic function of the time since the loss, quickly at first, flat around
+    the window where the loss happened, and then quickly again to probe for more bandwidth. The growth does not
+    depend on the RTT, so paths with a long RTT fill up as fast as short ones.
+    """
+
+    C = 0.4  # Scaling constant of the cubic function
+    BETA = 0.7  # Multiplicative decrease factor
+
+    def __init__(self, max_window: int, clock: Callable[[], float] = time.monotonic):
+        """
+        Create a controller
+        :param max_window: largest window the sender may use, in packets
+        :param clock: function returning the current time in seconds
+        """
+        super().__init__(max_window)
+        self.clock = clock
+        self.w_max = 0.0  # Window at the last loss
+        self.k = 0.0  # Time it takes to grow back to w_max
+        self.epoch_start: Optional[float] = None  # Start of the current congestion avoidance period
+        self.w_est = 0.0  # Window a Reno sender would have, used in the TCP friendly region
+
+    def on_ack(self, acked: int, rtt: Optional[float]) -> None:
+        if self.cwnd < self.ssthresh:
+            # Slow start
+            self.cwnd = min(self.cwnd + acked, float(self.max_window))
+            return
+
+        now = self.clock()
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = self.cwnd
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = self.cwnd
+
+        # Window the cubic function gives one RTT from now
+        t = now - self.epoch_start + (rtt or 0.0)
+        target = self.C * (t - self.k) ** 3 + self.w_max
+
+        # A Reno sender would grow by 3 * (1 - beta) / (1 + beta) packets per RTT
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * acked / self.cwnd
+
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+        self.cwnd = min(max(self.cwnd, self.w_est), float(self.max_window))
+
+    def on_loss(self) -> None:
+        # Fast convergence, release bandwidth to new flows if the window did not grow back since the last loss
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, 2.0)
+        self.cwnd = self.ssthresh
+        self.epoch_start = None
+
+    def on_timeout(self) -> None:
+        self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, 2.0)
+        self.cwnd = 1.0
+        self.epoch_start = None
+
+
+CONGESTION_CONTROLLERS: Dict[str, Type[CongestionControl]] = {"none": FixedWindow, "reno": Reno, "cubic": Cubic}
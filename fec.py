@@ -0,0 +1,232 @@
+from typing import Dict, List, Tuple, Union
+
+"""
+Forward error correction with XOR parity packets, for selective repeat.
+The data packets are grouped in blocks of a fixed number of packets, the first block starts at sequence number 1. Right
+after the last packet of a block, the client sends 1, 2 or 4 parity packets for it. With M parity packets, parity
+packet j is the XOR of the packets at positions j, j + M, j + 2M, ... of the block, each padded with zeros to the
+longest of them, so the server rebuilds one lost packet of each of the M groups without a retransmission. Spreading
+the groups over the block lets M parity packets repair a burst of M lost packets in a row.
+M is chosen for every block from the loss rate the client observes. Every M divides MAX_PARITY, so the server keeps one
+running XOR of the packets at every position modulo MAX_PARITY, and combines them into the groups of the M the client
+chose once the parity packets arrive.
+Reed-Solomon codes repair any M lost packets of a block, but cost finite field arithmetic on every byte, which is too
+slow in python. XOR runs on python ints in C.
+"""
+
+MAX_PARITY = 4
+PARITY_COUNTS = (1, 2, 4)  # Number of parity packets that can be sent for a block, every one divides MAX_PARITY
+LOSS_GAIN = 0.125  # Weight of a new sample in the average loss rate
+MAX_BLOCK = 255  # Largest number of data packets in a block
+
+
+def block_start(seq: int, block: int) -> int:
+    """
+    Get the first packet of the block a packet belongs to
+    :param seq: sequence number of a data packet
+    :param block: number of data packets in a block
+    :return: sequence number of the first packet of the block
+    """
+    return (seq - 1) // block * block + 1
+
+
+def pack_fields(count: int, parity: int, index: int) -> int:
+    """
+    Pack what a parity packet covers into the ack field of its header
+    :param count: number of data packets in the block, the last block can be short
+    :param parity: number of parity packets sent for the block
+    :param index: index of the parity packet
+    :return: value of the ack field
+    """
+    return count << 16 | parity << 8 | index
+
+
+def unpack_fields(fields: int) -> Tuple[int, int, int]:
+    """
+    Unpack the ack field of a parity packet
+    :param fields: value of the ack field
+    :return: number of data packets in the block, number of parity packets and index of the parity packet
+    """
+    return fields >> 16, fields >> 8 & 0xFF, fields & 0xFF
+
+
+class ParityEncoder:
+    """
+    Computes the parity packets of the client, and chooses how many to send for a block from the loss rate.
+    """
+
+    def __init__(self, block: int):
+        """
+        Create an encoder
+        :param block: number of data packets in a block
+        """
+        self.block = block
+        self.loss_rate = 0.0
+
+    def observe(self, delivered: int, lost: int) -> None:
+        """
+        Update the average loss rate
+        :param delivered: number of packets acked
+        :param lost: number of packets found lost
+        """
+        if delivered + lost:
+            self.loss_rate += LOSS_GAIN * (lost / (delivered + lost) - self.loss_rate)
+
+    @property
+    def parity_count(self) -> int:
+        """
+        :return: number of parity packets to send for a block, enough to repair twice the losses expected in it
+        """
+        expected = 2 * self.block * self.loss_rate
+        for count in PARITY_COUNTS:
+            if count >= expected:
+                return count
+        return MAX_PARITY
+
+    def encode(self, chunks: List[Union[bytes, memoryview]]) -> List[Tuple[int, int, bytes]]:
+        """
+        Compute the parity packets of a block
+        :param chunks: data of every packet of the block, in order
+        :return: list of (ack field, XOR of the lengths of the packets, parity data) for every parity packet
+        """
+        parity = self.parity_count
+        packets = []
+        for index in range(min(parity, len(chunks))):
+            value, lengths, size = 0, 0, 0
+            for chunk in chunks[index::parity]:
+                value ^= int.from_bytes(chunk, "little")
+                lengths ^= len(chunk)
+                size = max(size, len(chunk))
+            packets.append((pack_fields(len(chunks), parity, index), lengths, value.to_bytes(size, "little")))
+        return packets
+
+
+class _Block:
+    """
+    What the server has received of a block: the running XOR and the XOR of the lengths of the packets at every
+    position modulo MAX_PARITY, which positions have been received, and the parity packets waiting for a loss.
+    """
+
+    def __init__(self):
+        self.values = [0] * MAX_PARITY
+        self.lengths = [0] * MAX_PARITY
+        self.received = 0  # Bit i is set if the packet at position i has been received or rebuilt
+        self.parities: Dict[Tuple[int, int], Tuple[int, int, int]] = {}  # (parity, index): (count, lengths, value)
+
+    def add(self, position: int, data: Union[bytes, memoryview]) -> bool:
+        """
+        Add a packet to the running XOR
+        :param position: position of the packet in the block
+        :param data: data of the packet
+        :return: False if the packet was already added
+        """
+        if self.received >> position & 1:
+            return False
+        self.received |= 1 << position
+        self.values[position % MAX_PARITY] ^= int.from_bytes(data, "little")
+        self.lengths[position % MAX_PARITY] ^= len(data)
+        return True
+
+
+class ParityDecoder:
+    """
+    Rebuilds lost packets on the server from the parity packets of their block.
+    Blocks are forgotten when every packet in them has been written. Blocks that start before the first packet of the
+    transfer, which happens when a transfer is resumed, are never decoded.
+    """
+
+    def __init__(self, block: int, start: int):
+        """
+        Create a decoder
+        :param block: number of data packets in a block
+        :param start: sequence number of the first packet expected
+        """
+        self.block = block
+        self.start = start
+        self.rebuilt = 0
+        self._blocks: Dict[int, _Block] = {}
+        self._written = start  # Every packet before this sequence number has been written
+
+    def _get(self, first: int) -> _Block:
+        """
+        Get the state of a block, creating it when the first packet of it arrives
+        :param first: sequence number of the first packet of the block
+        :return: the block
+        """
+        block = self._blocks.get(first)
+        if block is None:
+            block = self._blocks[first] = _Block()
+        return block
+
+    def received(self, seq: int, data: Union[bytes, memoryview]) -> List[Tuple[int, bytes]]:
+        """
+        Add a data packet received for the first time
+        :param seq: sequence number of the packet
+        :param data: data of the packet
+        :return: list of (sequence number, data) of the packets that could be rebuilt with it
+        """
+        first = block_start(seq, self.block)
+        if first < self.start:
+            return []
+        block = self._get(first)
+        if not block.add(seq - first, data) or not block.parities:
+            return []
+        return self._rebuild(first, block)
+
+    def parity(self, first: int, fields: int, lengths: int, data: Union[bytes, memoryview]) -> List[Tuple[int, bytes]]:
+        """
+        Add a parity packet
+        :param first: sequence number of the first packet of the block
+        :param fields: ack field of the parity packet
+        :param lengths: XOR of the lengths of the packets it covers
+        :param data: parity data
+        :return: list of (sequence number, data) of the packets that could be rebuilt with it
+        """
+        count, parity, index = unpack_fields(fields)
+        if (first < self.start or first + self.block <= self._written or block_start(first, self.block) != first
+                or not 0 < count <= self.block or parity not in PARITY_COUNTS or index >= parity):
+            return []
+        block = self._get(first)
+        block.parities[(parity, index)] = (count, lengths, int.from_bytes(data, "little"))
+        return self._rebuild(first, block)
+
+    def _rebuild(self, first: int, block: _Block) -> List[Tuple[int, bytes]]:
+        """
+        Rebuild every packet that is the only one missing from the group of a parity packet of the block
+        :param first: sequence number of the first packet of the block
+        :param block: the block
+        :return: list of (sequence number, data) of the packets rebuilt
+        """
+        rebuilt = []
+        for (parity, index), (count, lengths, value) in list(block.parities.items()):
+            missing = [position for position in range(index, count, parity) if not block.received >> position & 1]
+            if len(missing) != 1:
+                if not missing:
+                    del block.parities[(parity, index)]
+                continue
+
+            # XOR the packets of the group that were received out of the parity
+            for residue in range(index, MAX_PARITY, parity):
+                value ^= block.values[residue]
+                lengths ^= block.lengths[residue]
+            try:
+                data = value.to_bytes(lengths, "little")
+            except OverflowError:
+                # The parity does not match the packets, they were not all sent with it
+                del block.parities[(parity, index)]
+                continue
+
+            del block.parities[(parity, index)]
+            block.add(missing[0], data)
+            rebuilt.append((first + missing[0], data))
+        self.rebuilt += len(rebuilt)
+        return rebuilt
+
+    def forget(self, before: int) -> None:
+        """
+        Forget the blocks that end before a sequence number
+        :param before: every packet before this sequence number has been written
+        """
+        self._written = before
+        for first in [first for first in self._blocks if first + self.block <= before]:
+            del self._blocks[first]
@@ -0,0 +1,91 @@
+import os
+
+
+class FileSink:
+    """
+    Writes received data straight to disk at its offset in the file.
+    The file is preallocated to its final size when it is opened, so chunks can be written in any order
+    and memory use does not depend on the size of the file.
+    """
+
+    def __init__(self, path: str, size: int, truncate: bool = True):
+        """
+        Open and preallocate the file
+        :param path: path of the file to write
+        :param size: final size of the file in bytes
+        :param truncate: False to keep what is already in the file, to resume writing it
+        """
+        self.path = path
+        self.size = size
+        self.bytes_written = 0
+
+        # O_BINARY is only defined (and needed) on windows
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0) | (os.O_TRUNC if truncate else 0)
+        self._fd = os.open(path, flags, 0o644)
+        self._preallocate()
+
+    def _preallocate(self) -> None:
+        """
+        Reserve disk space for the whole file.
+        Falls back to extending the file with ftruncate if fallocate is not supported by the platform or file system.
+        """
+        if self.size <= 0:
+            return
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self._fd, 0, self.size)
+                return
+            except OSError:
+                pass
+        os.ftruncate(self._fd, self.size)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        """
+        Write data at the given offset in the file
+        :param offset: offset in bytes from the start of the file
+        :param data: data to write
+        :raises ValueError: if the file is closed or the data does not fit inside the preallocated file
+        """
+        if self._fd is None:
+            raise ValueError("File is closed")
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(f"Chunk at offset {offset} with length {len(data)} is outside the file")
+
+        self.bytes_written += len(data)
+
+        # A memoryview lets us retry short writes without copying the remaining data
+        view = memoryview(data)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            while view:
+                view = view[os.write(self._fd, view):]
+
+    @property
+    def closed(self) -> bool:
+        return self._fd is None
+
+    def sync(self) -> None:
+        """
+        Flush what has been written to disk, so it survives a crash of the machine
+        """
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+    def close(self) -> None:
+        """
+        Close the file. Calling close more than once has no effect.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,56 @@
+import mmap
+import os
+
+
+class FileSource:
+    """
+    Reads the data to send straight from a memory map of the file.
+    Chunks are handed out as memoryviews of the map, so sending and resending data never copies it into python
+    objects, and the sender only has to remember where a packet's data is in the file instead of keeping the data.
+    The map is read-only, so it only takes the memory of the pages that are read, and files larger than the memory of
+    the host can be sent.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open and map the file
+        :param path: path of the file to read
+        """
+        self.path = path
+        self.size = os.path.getsize(path)
+
+        # A file of zero bytes can not be mapped, it has no chunks to hand out anyway
+        self._map = None
+        self._view = memoryview(b"")
+        if self.size > 0:
+            with open(path, "rb") as file:
+                self._map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+
+    def read_at(self, offset: int, length: int) -> memoryview:
+        """
+        Get a chunk of the file without copying it
+        :param offset: offset in bytes from the start of the file
+        :param length: largest number of bytes to get
+        :return: view of the chunk, shorter than length at the end of the file and empty after it
+        """
+        return self._view[offset:offset + length]
+
+    def close(self) -> None:
+        """
+        Unmap the file. Calling close more than once has no effect.
+        If views of the map are still in use, the map is left to be unmapped when they are released.
+        """
+        if self._map is not None:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,40 @@
+from typing import Dict, Tuple, Union
+
+"""
+Options block of the handshake.
+The syn of the client carries everything the server needs to receive the file: its name, size and the reliability
+method, the window and payload size the client can use, and the optional features it asks for. The syn-ack carries
+what the server chose, and data packets follow it right away, so the file starts flowing one round trip after the syn.
+The block starts with a version byte, followed by key=value options separated by SEP. Options a side does not know
+are ignored, so new options can be added without a new version. The syns that probe the path MTU are padded with
+zeros, so a syn that starts with a zero byte is a probe and not an options block.
+"""
+
+OPTIONS_VERSION = 1
+SEP = "<SEPARATOR>"
+
+
+def encode_options(options: Dict[str, object]) -> bytes:
+    """
+    Encode an options block
+    :param options: value of every option, options that are None are left out
+    :return: the options block
+    """
+    fields = SEP.join(f"{key}={value}" for key, value in options.items() if value is not None)
+    return bytes([OPTIONS_VERSION]) + fields.encode()
+
+
+def decode_options(data: Union[bytes, memoryview]) -> Tuple[int, Dict[str, str]]:
+    """
+    Decode an options block
+    :param data: the options block
+    :return: version of the block and the value of every option, no options if the version is not known
+    :raises ValueError: if the options are not valid text
+    """
+    if not data:
+        return 0, {}
+    version = data[0]
+    if version != OPTIONS_VERSION:
+        return version, {}
+    fields = bytes(data[1:]).decode().split(SEP)
+    return version, dict(field.partition("=")[::2] for field in fields if field)
@@ -0,0 +1,95 @@
+import math
+import sys
+import time
+from typing import Callable, Optional
+
+"""
+Pacing of the packets the client sends.
+Without pacing, a window of packets leaves back to back at the speed of the network card, and a router with a short
+queue in front of a slower link drops the end of the burst. The pacer is a token bucket that fills at the pacing rate,
+and a packet is only sent when there are tokens for it, so the window is spread over the round trip instead.
+The transfer does not sleep between packets: it waits for acks with a timeout that ends when the bucket has tokens
+again. Those timeouts have a resolution of about a millisecond, so the bucket holds BURST_TIME of tokens, and every
+wakeup sends the packets of the time that has passed in one batch. The rate stays accurate at any speed, since tokens
+are counted from the clock, and a burst is never longer than BURST_TIME at the pacing rate.
+"""
+
+BURST_TIME = 0.002  # Longest burst in seconds at the pacing rate, a little more than the resolution of timeouts
+MIN_BURST = 2  # Smallest burst in packets, so a slow rate still sends whole packets
+
+
+class Pacer:
+    """
+    Token bucket that limits the rate of the packets sent. A packet may be sent while the bucket is not empty, and
+    takes the tokens of its size, so the bucket can go into debt by one packet. Packets sent without asking, like
+    retransmissions, also take their tokens and delay the next packets.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """
+        Create a pacer without a rate, which lets every packet through
+        :param clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self.rate: Optional[float] = None  # Pacing rate in bytes per second, None if packets are not paced
+        self.depth = 0.0  # Size of the bucket in bytes
+        self.tokens = 0.0
+        self._last = clock()
+
+    def _refill(self) -> None:
+        """
+        Add the tokens of the time since the last refill
+        """
+        now = self.clock()
+        if self.rate is not None:
+            self.tokens = min(self.tokens + (now - self._last) * self.rate, self.depth)
+        self._last = now
+
+    def set_rate(self, rate: Optional[float], packet_size: int) -> None:
+        """
+        Change the pacing rate. The bucket starts full when packets start being paced.
+        :param rate: pacing rate in bytes per second, None to stop pacing
+        :param packet_size: largest size of a packet in bytes
+        """
+        self._refill()
+        if rate is None:
+            self.rate = None
+            return
+        depth = max(rate * BURST_TIME, MIN_BURST * packet_size)
+        if self.rate is None:
+            self.tokens = depth
+        self.rate = rate
+        self.depth = depth
+        self.tokens = min(self.tokens, depth)
+
+    def allowance(self, packet_size: int) -> int:
+        """
+        Get the number of packets that may be sent now
+        :param packet_size: largest size of a packet in bytes
+        :return: number of packets, 0 if the next packet has to wait
+        """
+        if self.rate is None:
+            return sys.maxsize
+        self._refill()
+        if self.tokens <= 0:
+            return 0
+        return math.ceil(self.tokens / packet_size)
+
+    def consume(self, size: int) -> None:
+        """
+        Take the tokens of packets that are sent
+        :param size: total size of the packets in bytes
+        """
+        if self.rate is not None:
+            self._refill()
+            self.tokens -= size
+
+    def delay(self) -> float:
+        """
+        Get the time until the next packet may be sent
+        :return: time in seconds, 0 if it may be sent now, infinite if packets are not paced
+        """
+        if self.rate is None:
+            return math.inf
+        self._refill()
+        return max(-self.tokens / self.rate, 0.0)
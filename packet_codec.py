@@ -0,0 +1,80 @@
+from struct import Struct
+from typing import Optional, Tuple, Union
+
+# I integer (unsigned long) = 4bytes and H (unsigned short integer 2 bytes)
+HEADER_FORMAT = '!IIHH'
+HEADER = Struct(HEADER_FORMAT)  # Compiled once, so packing and unpacking does not parse the format string
+HEADER_SIZE = HEADER.size
+
+# Flag bits of the header
+SYN_FLAG = 1 << 3  # 1000
+ACK_FLAG = 1 << 2  # 0100
+FIN_FLAG = 1 << 1  # 0010
+RST_FLAG = 1       # 0001, the server rejects the transfer, the data carries the reason
+PARITY_FLAG = 1 << 4  # 10000, parity of a block of data packets, see fec.py
+
+
+def encode(seq: int, ack: int, flags: int, win: int, data: Optional[bytes] = None) -> bytes:
+    """
+    Pack a header and the data following it into a new packet
+    :param seq: sequence number of the packet
+    :param ack: acknowledgment number of the packet
+    :param flags: flags of the packet
+    :param win: receiver window of the packet
+    :param data: application data of the packet
+    :return: packet with header and application data
+    """
+    if data:
+        return HEADER.pack(seq, ack, flags, win) + data
+    return HEADER.pack(seq, ack, flags, win)
+
+
+class HeaderPool:
+    """
+    Reusable buffer the headers of a batch of packets are packed into in place, so building a packet does not allocate
+    its header. Headers are views of the buffer and stay valid until the pool is released, which the sender does when
+    it starts building its next batch, after the last one has been sent. A batch that needs more headers than the
+    buffer holds gets a new buffer twice the size, the headers handed out before keep the old one alive.
+    """
+
+    def __init__(self, count: int):
+        """
+        Create a pool
+        :param count: number of headers the buffer holds at first, the largest batch expected
+        """
+        self._buffer = bytearray(max(count, 1) * HEADER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._used = 0  # Bytes of the buffer holding headers handed out since the last release
+
+    def encode(self, seq: int, ack: int, flags: int, win: int) -> memoryview:
+        """
+        Pack a header into the next free slot of the buffer
+        :param seq: sequence number of the packet
+        :param ack: acknowledgment number of the packet
+        :param flags: flags of the packet
+        :param win: receiver window of the packet
+        :return: view of the header, valid until the pool is released
+        """
+        start = self._used
+        if start + HEADER_SIZE > len(self._buffer):
+            self._buffer = bytearray(2 * len(self._buffer))
+            self._view = memoryview(self._buffer)
+            start = 0
+        HEADER.pack_into(self._buffer, start, seq, ack, flags, win)
+        self._used = start + HEADER_SIZE
+        return self._view[start:self._used]
+
+    def release(self) -> None:
+        """
+        Hand out the slots of the buffer again, the headers of the batch before are no longer used
+        """
+        self._used = 0
+
+
+def decode_header(packet: Union[bytes, bytearray, memoryview]) -> Tuple[int, int, int, int]:
+    """
+    Unpack the header at the start of a packet, without copying it out of the packet first
+    :param packet: packet or buffer starting with a header
+    :return: sequence number, acknowledgment number, flags and receiver window
+    """
+    return HEADER.unpack_from(packet)
@@ -0,0 +1,71 @@
+import socket
+import sys
+from typing import List, Optional
+
+"""
+Path MTU discovery for the payload size of a transfer.
+Before its syn, the client sends a syn padded to every candidate datagram size with the don't fragment bit set, and the
+server keeps the size of the largest one it receives. A datagram that does not fit the path is dropped on the way, or
+refused by the kernel of the client, so the largest size received is the largest datagram that gets through
+unfragmented, and the server chooses the payload size from it on the syn-ack.
+The don't fragment bit is set with Linux socket options, elsewhere the path is not probed and the default size is used.
+"""
+
+IPV4_OVERHEAD = 28  # IPv4 and UDP headers in front of every datagram
+MAX_DATAGRAM = 0xFFFF - IPV4_OVERHEAD  # Largest UDP datagram over IPv4
+ETHERNET_MTU = 1500
+JUMBO_MTU = 9000
+
+# Linux socket options, not exposed by the socket module of every python version
+_IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+_IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+_IP_MTU = getattr(socket, "IP_MTU", 14)
+
+
+def route_mtu(sock) -> Optional[int]:
+    """
+    Get the MTU the kernel knows for the route of a connected socket, the MTU of the interface until it learns a
+    smaller one from the path
+    :param sock: connected UDP socket
+    :return: MTU in bytes, None if it is not known
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return sock.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+    except OSError:
+        return None
+
+
+def probe_sizes(sock, limit: int) -> List[int]:
+    """
+    Get the datagram sizes to probe, largest first: the MTU of the route, a jumbo frame and an Ethernet frame, none
+    larger than the route allows or than the limit
+    :param sock: connected UDP socket
+    :param limit: largest datagram wanted
+    :return: datagram sizes, empty if the path can not be probed
+    """
+    mtu = route_mtu(sock)
+    if mtu is None:
+        return []
+    largest = min(mtu - IPV4_OVERHEAD, MAX_DATAGRAM, limit)
+    sizes = {largest}
+    sizes.update(min(frame - IPV4_OVERHEAD, largest) for frame in (JUMBO_MTU, ETHERNET_MTU))
+    return sorted(sizes, reverse=True)
+
+
+def set_dont_fragment(sock, mode: Optional[int] = None) -> Optional[int]:
+    """
+    Set the don't fragment bit on the datagrams of a socket, or restore how the socket fragments them
+    :param sock: UDP socket
+    :param mode: mode to restore, returned by an earlier call, None to set the don't fragment bit
+    :return: the mode before the call, None if it can not be set on this platform
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        previous = sock.getsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER)
+        sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER, _IP_PMTUDISC_DO if mode is None else mode)
+        return previous
+    except OSError:
+        return None
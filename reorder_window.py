@@ -0,0 +1,109 @@
+from typing import Generator, List, Optional, Tuple, Union
+
+# Turns the received map (one byte per slot, 0 or 1) into a string of binary digits
+_BINARY_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+class ReorderWindow:
+    """
+    Fixed size ring buffer holding out-of-order packages for the selective repeat receiver.
+    Packages are stored in the slot given by their sequence number modulo the capacity, so inserting, looking up
+    and delivering a package costs the same no matter how large the window is. A package is only accepted when its
+    sequence number is inside [base, base + capacity), which puts a hard cap on the memory used for buffering.
+    The data of all slots lives in one preallocated bytearray, so storing a package copies its data into the ring
+    without allocating, and delivered data is handed out as memoryviews of the ring.
+    """
+
+    def __init__(self, capacity: int, base: int, slot_size: int):
+        """
+        Create an empty window
+        :param capacity: maximum number of packages the window can hold
+        :param base: sequence number of the next package expected in order
+        :param slot_size: largest amount of data a package can carry
+        """
+        if capacity < 1:
+            raise ValueError("Capacity of the reorder window must be at least 1")
+
+        self.capacity = capacity
+        self.base = base
+        self.highest = base - 1  # Highest sequence number accepted so far
+        self.buffered = 0  # Number of packages currently held in the window
+
+        self.slot_size = slot_size
+        self._storage = memoryview(bytearray(capacity * slot_size))
+        self._lengths: List[int] = [0] * capacity  # Length of the data held in each slot
+        self._received = bytearray(capacity)  # One byte per slot, 1 if the slot holds a package
+
+    def insert(self, seq: int, data: Optional[Union[bytes, memoryview]]) -> bool:
+        """
+        Store a package in the window. The data is copied into the ring, so the caller may reuse its buffer.
+        :param seq: sequence number of the package
+        :param data: data carried by the package, None if the package carries no data
+        :return: True if the package was stored, False if it is a duplicate or falls outside the window
+        :raises ValueError: if the data does not fit in a slot
+        """
+        if seq < self.base or seq >= self.base + self.capacity:
+            return False
+
+        index = seq % self.capacity
+        if self._received[index]:
+            return False
+
+        length = len(data) if data is not None else 0
+        if length > self.slot_size:
+            raise ValueError(f"Package {seq} carries {length} bytes, slots only hold {self.slot_size} bytes")
+        start = index * self.slot_size
+        self._storage[start:start + length] = data if data is not None else b""
+        self._lengths[index] = length
+        self._received[index] = 1
+        self.buffered += 1
+        if seq > self.highest:
+            self.highest = seq
+        return True
+
+    def pop_contiguous(self) -> Generator[Tuple[int, memoryview], None, None]:
+        """
+        Deliver the run of packages starting at base, in order, and release their slots.
+        Stops at the first sequence number that has not been received yet.
+        The data is a view of the ring and is only valid until a package is inserted into the released slot.
+        :return: generator of (sequence number, data) tuples
+        """
+        while self._received[self.base % self.capacity]:
+            index = self.base % self.capacity
+            start = index * self.slot_size
+            data = self._storage[start:start + self._lengths[index]]
+            self._received[index] = 0
+            self.buffered -= 1
+            seq = self.base
+            self.base += 1
+            yield seq, data
+
+    def free_slots(self) -> int:
+        """
+        Get the number of slots that do not hold a package waiting behind a gap.
+        Acks carry the cumulative ack base - 1, and this is the window advertised from it, so the window shrinks while
+        packages are held for a gap that is not repaired, and opens again when they are delivered.
+        :return: number of free slots
+        """
+        return self.capacity - self.buffered
+
+    def sack_bitmap(self, max_bytes: int) -> bytes:
+        """
+        Get a bitmap of the packages received after base + 1, to be sent as selective acknowledgement.
+        Bit i (little endian) is set if package base + 1 + i has been received. The bitmap is cut off after max_bytes.
+        :param max_bytes: largest bitmap to return
+        :return: bitmap, empty if no packages are waiting in the window
+        """
+        length = min(self.highest - self.base, max_bytes * 8)
+        if length <= 0:
+            return b""
+
+        start = (self.base + 1) % self.capacity
+        received = self._received[start:start + length]
+        if len(received) < length:
+            # Wrap around the end of the ring
+            received += self._received[:length - len(received)]
+
+        # The first package has to end up in the lowest bit, so the digits are reversed before parsing
+        bits = int(received[::-1].translate(_BINARY_DIGITS), 2)
+        return bits.to_bytes((length + 7) // 8, "little")
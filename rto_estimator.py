@@ -0,0 +1,61 @@
+class RtoEstimator:
+    """
+    Retransmission timeout estimator as described in RFC 6298.
+    Keeps a smoothed round trip time (srtt) and its variation (rttvar) that are updated for every RTT sample.
+    Samples must only be taken from packets that were not retransmitted (Karn's rule), because the ack of a
+    retransmitted packet can not be matched to the transmission it acknowledges.
+    Every timeout doubles the timeout (exponential backoff) until a new valid sample is taken.
+    """
+
+    ALPHA = 1 / 8  # Gain of the smoothed RTT
+    BETA = 1 / 4  # Gain of the RTT variation
+    K = 4  # Multiplier of the RTT variation
+
+    def __init__(self, initial: float = 0.5, minimum: float = 0.05, maximum: float = 10.0):
+        """
+        Create an estimator without any RTT samples
+        :param initial: timeout in seconds used until the first sample is taken
+        :param minimum: lower limit of the timeout in seconds
+        :param maximum: upper limit of the timeout in seconds
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self._rto = self._clamp(initial)
+
+    def _clamp(self, value: float) -> float:
+        """
+        Limit a timeout value to the range [minimum, maximum]
+        :param value: timeout in seconds
+        :return: clamped timeout in seconds
+        """
+        return min(max(value, self.minimum), self.maximum)
+
+    @property
+    def timeout(self) -> float:
+        """
+        Get the current retransmission timeout
+        :return: timeout in seconds
+        """
+        return self._rto
+
+    def sample(self, rtt: float) -> None:
+        """
+        Update the estimate with a new RTT sample. This also clears any backoff.
+        :param rtt: measured round trip time in seconds of a packet that was only sent once
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self._rto = self._clamp(self.srtt + self.K * self.rttvar)
+
+    def backoff(self) -> None:
+        """
+        Double the timeout after a retransmission timeout
+        """
+        self._rto = self._clamp(self._rto * 2)
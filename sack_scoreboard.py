@@ -0,0 +1,89 @@
+from typing import List
+
+
+class SackScoreboard:
+    """
+    Keeps track of which packets the server has received, from acks carrying a cumulative ack and a SACK bitmap.
+    Bit i of the bitmap tells that the packet with sequence number cumulative ack + 2 + i has been received, the packet
+    right after the cumulative ack is always missing. The received packets above the cumulative ack are kept as a
+    python int used as a bit set, so merging a bitmap and finding holes runs in C, and the python code only loops
+    over packets that are acked or lost for the first time.
+    """
+
+    def __init__(self, base: int):
+        """
+        Create an empty scoreboard
+        :param base: sequence number of the first packet that has not been acked
+        """
+        self.base = base
+        self._sacked = 0  # Bit i is set if packet base + i has been selectively acked
+        self._loss_scan = base  # Packets below this sequence number have already been checked for loss
+
+    def update(self, cumulative_ack: int, bitmap: bytes) -> List[int]:
+        """
+        Merge an ack into the scoreboard
+        :param cumulative_ack: every packet up to and including this sequence number has been received
+        :param bitmap: SACK bitmap of the packets received after cumulative_ack + 1, little endian
+        :return: sequence numbers that may be acked for the first time by this ack, in increasing order.
+                 Packets acked cumulatively are included even if they were selectively acked before.
+        """
+        acked: List[int] = []
+
+        # Cumulative part, move the base forward
+        if cumulative_ack >= self.base:
+            acked.extend(range(self.base, cumulative_ack + 1))
+            self._sacked >>= cumulative_ack + 1 - self.base
+            self.base = cumulative_ack + 1
+            self._loss_scan = max(self._loss_scan, self.base)
+
+        # Selective part, align the bitmap to the base
+        bits = int.from_bytes(bitmap, "little")
+        if bits:
+            shift = cumulative_ack + 2 - self.base
+            bits = bits << shift if shift >= 0 else bits >> -shift
+            new = bits & ~self._sacked
+            self._sacked |= bits
+            while new:
+                lowest = new & -new
+                acked.append(self.base + lowest.bit_length() - 1)
+                new ^= lowest
+
+        return acked
+
+    @property
+    def highest(self) -> int:
+        """
+        :return: highest sequence number the server has received
+        """
+        return self.base + self._sacked.bit_length() - 1
+
+    def lost(self, threshold: int = 3) -> List[int]:
+        """
+        Find packets that are considered lost because at least threshold packets after them have been received.
+        Every packet is only reported once, if it is lost again its retransmission timer has to find it.
+        :param threshold: number of received packets after a hole before it is considered lost
+        :return: sequence numbers of lost packets, in increasing order
+        """
+        # Remove the highest set bits to find the packet that has threshold received packets above and including it
+        sacked = self._sacked
+        for _ in range(threshold - 1):
+            if not sacked:
+                return []
+            sacked ^= 1 << (sacked.bit_length() - 1)
+        if not sacked:
+            return []
+        limit = sacked.bit_length() - 1  # Offset from base of the first packet that is not considered lost
+
+        start = self._loss_scan - self.base
+        if start >= limit:
+            return []
+        self._loss_scan = self.base + limit
+
+        # Holes are the bits that are not set between start and limit
+        holes = ~self._sacked & ((1 << limit) - 1) & ~((1 << start) - 1)
+        lost: List[int] = []
+        while holes:
+            lowest = holes & -holes
+            lost.append(self.base + lowest.bit_length() - 1)
+            holes ^= lowest
+        return lost
@@ -0,0 +1,111 @@
+from typing import List
+
+import pytest
+
+from application import Client, Server, create_packet, DATA_SIZE, SYN_FLAG, ACK_FLAG
+from arg_parser import parse_args
+from handshake_options import encode_options
+from packet_codec import decode_header
+
+"""
+Tests of the receiver window: the server advertises the room it has, and the client stops sending when the window
+closes and probes it with one packet at a time until it opens again.
+"""
+
+
+class RecordingClient(Client):
+    """
+    Client that records the packets it sends instead of sending them
+    """
+
+    def __init__(self, options, filepath=None):
+        Client.__init__(self, options, filepath)
+        self.sent: List[int] = []
+
+    def transmit(self, packets) -> None:
+        for packet in packets:
+            header = packet[0] if isinstance(packet, tuple) else packet
+            self.sent.append(decode_header(header)[0])
+
+
+def acks_of(server: Server, address) -> List[tuple]:
+    """
+    Take the packages the server queued for an address
+    :return: list of (ack, win) of the packages
+    """
+    headers = [decode_header(package)[1::2] for package, to in zip(server.queued_packages, server.queued_addresses)
+               if to == address]
+    server.queued_packages.clear()
+    server.queued_addresses.clear()
+    return headers
+
+
+def syn(name: str, method: str) -> memoryview:
+    options = {"name": name, "method": method, "size": 20 * DATA_SIZE, "window": 64, "payload": DATA_SIZE}
+    return memoryview(create_packet(0, 0, SYN_FLAG, 0, encode_options(options)))
+
+
+def data(seq: int) -> memoryview:
+    return memoryview(create_packet(seq, 0, 0, 0, bytes(DATA_SIZE)))
+
+
+def test_window_is_shared_by_open_connections(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = Server(parse_args(["-s", "-k", "-r", "gbn", "-b", "2"]))
+    first, second, third = ("127.0.0.1", 1001), ("127.0.0.1", 1002), ("127.0.0.1", 1003)
+
+    server.dispatch(syn("a.bin", "gbn"), first)
+    assert acks_of(server, first) == [(0, 2)]
+    server.dispatch(syn("b.bin", "gbn"), second)
+    assert acks_of(server, second) == [(0, 1)]
+    server.dispatch(syn("c.bin", "gbn"), third)
+    assert acks_of(server, third) == [(0, 0)]
+
+    # The window of the first connection shrinks to its share
+    server.dispatch(data(1), first)
+    assert acks_of(server, first) == [(1, 0)]
+    server.close_connections()
+
+
+def test_window_shrinks_while_packets_wait_for_a_gap(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = Server(parse_args(["-s", "-r", "sr", "-b", "4"]))
+    address = ("127.0.0.1", 1001)
+
+    server.dispatch(syn("a.bin", "sr"), address)
+    assert acks_of(server, address) == [(0, 4)]
+    server.dispatch(data(2), address)
+    server.dispatch(data(3), address)
+    assert acks_of(server, address) == [(0, 3), (0, 2)]
+
+    # The missing packet is delivered with the packets waiting for it, and the window opens again
+    server.dispatch(data(1), address)
+    assert acks_of(server, address) == [(3, 4)]
+    server.close_connections()
+
+
+@pytest.mark.parametrize("method", ["gbn", "sr"])
+def test_client_stops_and_probes_a_closed_window(tmp_path, method):
+    path = tmp_path / "f.bin"
+    path.write_bytes(bytes(20 * DATA_SIZE))
+    client = RecordingClient(parse_args(["-c", "-r", method, "-w", "8", "-m", str(DATA_SIZE), "-f", str(path)]))
+    transfer = client.transfer()
+
+    def reply(ack: int, win: int, flags: int = ACK_FLAG, options: bytes = None) -> List[int]:
+        client.sent.clear()
+        transfer.send(client.parse_acks([create_packet(0, ack, flags, win, options)]))
+        return list(client.sent)
+
+    next(transfer)
+    assert client.sent == [0]
+
+    # The syn-ack opens a window of 4 packets, less than the window of the client
+    assert reply(0, 4, SYN_FLAG | ACK_FLAG, encode_options({"payload": DATA_SIZE})) == [1, 2, 3, 4]
+
+    # The window closes, nothing is in flight, so one packet probes it after every ack
+    assert reply(4, 0) == [5]
+    assert reply(5, 0) == [6]
+
+    # The window opens again
+    assert reply(6, 3) == [7, 8, 9]
+    transfer.close()